@@ -0,0 +1,158 @@
+# backend/almacen.py
+# Formato en disco del índice, sin pickle:
+#   index.faiss    vectores (faiss.write_index). Para leer se puede abrir con mmap
+#                  (RAG_INDICE_MMAP); con faiss 1.10 solo las listas invertidas de IVF
+#                  quedan en el archivo mapeado, Flat y HNSW se copian igual a memoria
+#   chunks.sqlite  texto y metadata de cada chunk (tabla chunks) y la posición de
+#                  cada ID dentro del índice FAISS (tabla posiciones)
+# Los chunks se escriben en SQLite al agregarse (deltas); guardar solo agrega las
+# posiciones nuevas, salvo que un borrado haya compactado el índice.
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+import faiss
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+ARCHIVO_VECTORES = "index.faiss"
+ARCHIVO_CHUNKS = "chunks.sqlite"
+_LEGADO = ("index.pkl",)  # formato anterior (pickle de LangChain), ya no se lee
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, texto TEXT NOT NULL, metadata TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS posiciones (pos INTEGER PRIMARY KEY, id TEXT NOT NULL);
+"""
+
+
+class DocstoreSQLite(Docstore, AddableMixin):
+    def __init__(self, ruta: Path):
+        self.ruta = ruta
+        self._local = threading.local()  # una conexión por hilo
+        self._lock = threading.Lock()
+        self._mapping_guardado: Optional[dict] = None
+        self._hasta = 0  # posiciones guardadas: todas las menores a esta
+        self._conexion().executescript(_ESQUEMA)
+
+    def _conexion(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(str(self.ruta), timeout=30)
+            self._local.con = con
+        return con
+
+    def cerrar(self) -> None:
+        con = getattr(self._local, "con", None)
+        if con is not None:
+            con.close()
+            self._local.con = None
+
+    def search(self, search: str) -> Union[str, Document]:
+        fila = self._conexion().execute("SELECT texto, metadata FROM chunks WHERE id = ?", (search,)).fetchone()
+        if fila is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=fila[0], metadata=json.loads(fila[1]))
+
+    def add(self, texts: dict[str, Document]) -> None:
+        filas = [(i, d.page_content, json.dumps(d.metadata, ensure_ascii=False)) for i, d in texts.items()]
+        with self._lock:
+            con = self._conexion()
+            con.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?)", filas)
+            con.commit()
+
+    def delete(self, ids: list) -> None:
+        with self._lock:
+            con = self._conexion()
+            con.executemany("DELETE FROM chunks WHERE id = ?", [(i,) for i in ids])
+            con.commit()
+
+    def __len__(self) -> int:
+        return self._conexion().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def posiciones(self) -> dict[int, str]:
+        mapping = dict(self._conexion().execute("SELECT pos, id FROM posiciones ORDER BY pos"))
+        self.marcar_guardado(mapping)
+        return mapping
+
+    def guardar_posiciones(self, mapping: dict[int, str]) -> None:
+        # agregar suma posiciones al mismo dict; borrar (o las lápidas de HNSW/IVF) lo
+        # reemplaza por uno nuevo. Con lápidas las posiciones no son contiguas.
+        with self._lock:
+            con = self._conexion()
+            if mapping is self._mapping_guardado:
+                nuevas = [(p, i) for p, i in mapping.items() if p >= self._hasta]
+                con.executemany("INSERT OR REPLACE INTO posiciones VALUES (?, ?)", nuevas)
+            else:
+                con.execute("DELETE FROM posiciones")
+                con.executemany("INSERT INTO posiciones VALUES (?, ?)", sorted(mapping.items()))
+                con.execute("DELETE FROM chunks WHERE id NOT IN (SELECT id FROM posiciones)")
+            con.commit()
+            self.marcar_guardado(mapping)
+
+    def marcar_guardado(self, mapping: dict[int, str]) -> None:
+        self._mapping_guardado = mapping
+        self._hasta = max(mapping) + 1 if mapping else 0
+
+
+def existe(directorio: Path) -> bool:
+    return (directorio / ARCHIVO_VECTORES).exists() and (directorio / ARCHIVO_CHUNKS).exists()
+
+
+def cargar(directorio: Path, embeddings: Embeddings, mmap: bool = False) -> Optional[FAISS]:
+    """`mmap` abre el índice de solo lectura: no sirve para quien agrega o borra
+    (en IVF-PQ add y reset fallan con las listas en disco)."""
+    if not existe(directorio):
+        return None
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+    index = faiss.read_index(str(directorio / ARCHIVO_VECTORES), flags)
+    docstore = DocstoreSQLite(directorio / ARCHIVO_CHUNKS)
+    mapping = docstore.posiciones()
+    # menos posiciones que vectores: lápidas de HNSW/IVF (ver indices_ann.marcar_borrados)
+    if len(mapping) > index.ntotal or (mapping and max(mapping) >= index.ntotal):
+        print(f"[almacen] {ARCHIVO_CHUNKS} tiene {len(mapping)} posiciones y el índice {index.ntotal} vectores.")
+        return None
+    return FAISS(embeddings, index, docstore, mapping)
+
+
+def _escribir_docstore(ruta: Path, vs: FAISS) -> None:
+    tmp = ruta.with_name(ruta.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    nuevo = DocstoreSQLite(tmp)
+    ids = list(vs.index_to_docstore_id.values())
+    for i in range(0, len(ids), 1000):
+        lote = {doc_id: vs.docstore.search(doc_id) for doc_id in ids[i:i + 1000]}
+        nuevo.add({k: d for k, d in lote.items() if isinstance(d, Document)})
+    nuevo.guardar_posiciones(vs.index_to_docstore_id)
+    nuevo.cerrar()
+    os.replace(tmp, ruta)
+
+
+def guardar(directorio: Path, vs: FAISS) -> None:
+    directorio.mkdir(parents=True, exist_ok=True)
+    ruta_chunks = directorio / ARCHIVO_CHUNKS
+    docstore = vs.docstore
+    if isinstance(docstore, DocstoreSQLite) and docstore.ruta == ruta_chunks:
+        docstore.guardar_posiciones(vs.index_to_docstore_id)
+    else:
+        # índice recién construido (docstore en memoria): archivo nuevo completo y
+        # desde aquí el vectorstore lee de SQLite
+        _escribir_docstore(ruta_chunks, vs)
+        vs.docstore = DocstoreSQLite(ruta_chunks)
+        vs.docstore.marcar_guardado(vs.index_to_docstore_id)
+
+    tmp = directorio / (ARCHIVO_VECTORES + ".tmp")
+    faiss.write_index(vs.index, str(tmp))
+    os.replace(tmp, directorio / ARCHIVO_VECTORES)
+    for nombre in _LEGADO:
+        (directorio / nombre).unlink(missing_ok=True)
+
+
+def borrar(directorio: Path, extras: Iterable[str] = ()) -> None:
+    for nombre in (ARCHIVO_VECTORES, ARCHIVO_CHUNKS, *_LEGADO, *extras):
+        (directorio / nombre).unlink(missing_ok=True)
@@ -0,0 +1,388 @@
+# backend/benchmark.py
+# Benchmark reproducible y sin red: el modelo de embeddings y Ollama se reemplazan
+# por stubs deterministas. Mide ingesta de los PDFs de data/, carga del índice,
+# latencia de recuperación a distintos tamaños de índice (corpus sintético armado
+# con oraciones de esos PDFs) y requests por segundo de punta a punta con
+# concurrencia. El resultado es un JSON para comparar entre commits.
+#
+#   python benchmark.py --salida bench.json
+#   python benchmark.py --tamanos 1000 10000 100000 --concurrencias 1 8 32 --latencia-llm-ms 200
+#
+# Usa una base SQLite y un índice temporales: no toca faiss_store ni la base del .env.
+from __future__ import annotations
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import re
+import subprocess
+import tempfile
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+BASE_DIR = Path(__file__).resolve().parent
+PREGUNTAS_BASE = [
+    "¿Qué es un SGSI?",
+    "¿Qué es Big Data?",
+    "¿Cuáles son las normas de seguridad de la información?",
+    "¿Qué establece la norma de gobernanza de datos?",
+    "¿Cuáles son las características del Big Data?",
+    "¿Quién es responsable de la gobernanza de datos?",
+]
+
+
+# --- stubs deterministas ---
+@lru_cache(maxsize=200_000)
+def _hash_palabra(palabra: str) -> int:
+    return int.from_bytes(hashlib.blake2b(palabra.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class EmbeddingsFalsos(Embeddings):
+    """Hashing de palabras a `dim` dimensiones: determinista, sin modelo, y textos
+    con palabras en común quedan cerca (la recuperación devuelve algo con sentido)."""
+
+    def __init__(self, model_name: str = "", dim: int = 384, **kwargs):
+        self.model_name = model_name
+        self.dim = dim
+
+    def _vector(self, texto: str) -> list[float]:
+        v = np.zeros(self.dim, dtype="float32")
+        for palabra in re.findall(r"\w+", texto.lower()):
+            h = _hash_palabra(palabra)
+            v[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        n = np.linalg.norm(v)
+        return (v / n if n else v).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._vector(text)
+
+
+LATENCIA_LLM_MS = 0.0
+RESPUESTA_LLM = "Respuesta de prueba generada por el LLM falso del benchmark."
+
+
+class LLMFalso(BaseChatModel):
+    """Reemplaza a ChatOllama: responde siempre lo mismo después de LATENCIA_LLM_MS."""
+
+    model: str = "falso"
+    temperature: float = 0
+    base_url: Optional[str] = None
+    keep_alive: Optional[str] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "falso"
+
+    def _resultado(self) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=RESPUESTA_LLM))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(LATENCIA_LLM_MS / 1000)
+        return self._resultado()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(LATENCIA_LLM_MS / 1000)
+        return self._resultado()
+
+
+def preparar_entorno(tmp: Path, args: argparse.Namespace) -> None:
+    # antes de importar el backend: la configuración se lee al importar
+    global LATENCIA_LLM_MS
+    LATENCIA_LLM_MS = args.latencia_llm_ms
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp / 'benchmark.db'}"
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ["RAG_DATA_DIR"] = str(args.datos)
+    os.environ["RAG_INDEX_DIR"] = str(tmp / "indice")
+    os.environ["RAG_RERANKER_MODELO"] = ""  # el cross-encoder necesita descargar un modelo
+    os.environ.setdefault("RAG_CACHE_ACTIVO", "0")  # preguntas distintas: medir el camino completo
+    os.environ.setdefault("RAG_LLM_COLA", "100000")
+    os.environ.setdefault("RAG_LLM_ESPERA", "3600")
+    os.environ["RAG_LLM_SALUD_SEGUNDOS"] = "0"  # no hay servidores Ollama que chequear
+
+    import langchain_community.embeddings
+    import langchain_ollama
+    langchain_community.embeddings.HuggingFaceEmbeddings = EmbeddingsFalsos
+    langchain_ollama.ChatOllama = LLMFalso
+
+
+# --- utilidades ---
+def percentiles(valores_s: list[float]) -> dict:
+    if not valores_s:
+        return {"p50_ms": None, "p99_ms": None, "media_ms": None}
+    ms = np.asarray(valores_s) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "media_ms": round(float(ms.mean()), 3),
+    }
+
+
+def commit_actual() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+# --- etapas ---
+def medir_ingesta(pdfs: list[Path], dir_indice: Path) -> dict:
+    import almacen
+    from cache_embeddings import EmbeddingsCacheados
+    from indexador import Manifiesto, sincronizar
+
+    embeddings = EmbeddingsCacheados(EmbeddingsFalsos(), dir_indice / "embeddings.sqlite", "falso")
+    manifiesto = Manifiesto(dir_indice / "manifiesto.json", splitter={})
+
+    t = time.perf_counter()
+    vs, res = sincronizar(None, pdfs, manifiesto, embeddings)
+    t_ingesta = time.perf_counter() - t
+    t = time.perf_counter()
+    almacen.guardar(dir_indice, vs)
+    manifiesto.guardar()
+    t_guardado = time.perf_counter() - t
+
+    t = time.perf_counter()
+    sincronizar(vs, pdfs, manifiesto, embeddings)
+    t_sin_cambios = time.perf_counter() - t
+
+    # reconstrucción completa con todos los embeddings ya en el cache en disco
+    t = time.perf_counter()
+    sincronizar(None, pdfs, Manifiesto(dir_indice / "otro.json", splitter={}), embeddings)
+    t_con_cache = time.perf_counter() - t
+
+    chunks = vs.index.ntotal if vs is not None else 0
+    return {
+        "pdfs": len(pdfs),
+        "chunks": chunks,
+        "chunks_duplicados": res.chunks_duplicados,
+        "segundos": round(t_ingesta, 4),
+        "chunks_por_segundo": round(chunks / t_ingesta, 1) if t_ingesta else None,
+        "guardado_s": round(t_guardado, 4),
+        "reindex_sin_cambios_s": round(t_sin_cambios, 4),
+        "reconstruccion_con_cache_s": round(t_con_cache, 4),
+    }
+
+
+def medir_carga(dir_indice: Path, repeticiones: int = 5) -> dict:
+    import almacen
+
+    tiempos = []
+    for _ in range(repeticiones):
+        t = time.perf_counter()
+        vs = almacen.cargar(dir_indice, EmbeddingsFalsos())
+        tiempos.append(time.perf_counter() - t)
+    return {
+        "vectores": vs.index.ntotal if vs is not None else 0,
+        "min_ms": round(min(tiempos) * 1000, 3),
+    }
+
+
+def oraciones_de(pdfs: list[Path]) -> list[str]:
+    from indexador import cargar_splits
+
+    oraciones = []
+    for pdf in pdfs:
+        for d in cargar_splits(pdf):
+            oraciones.extend(o.strip() for o in re.split(r"(?<=[.!?:])\s+", d.page_content) if len(o.strip()) > 30)
+    return list(dict.fromkeys(oraciones))
+
+
+def medir_recuperacion(oraciones: list[str], tamanos: list[int], n_consultas: int, lote: int, seed: int) -> list[dict]:
+    import rag_gratis
+    from cache_embeddings import EmbeddingsCacheados
+    from colecciones import Coleccion
+    from indexador import LOTE_EMBEDDINGS
+    from indices_ann import describir, nuevo_vectorstore
+    from recuperacion import IndiceBM25
+
+    rng = np.random.default_rng(seed)
+    resultados = []
+    for n in tamanos:
+        with tempfile.TemporaryDirectory() as tmp:
+            embeddings = EmbeddingsCacheados(EmbeddingsFalsos(), Path(tmp) / "emb.sqlite", "falso")
+            rag_gratis.embedding_model = embeddings
+            textos = [
+                " ".join(rng.choice(oraciones, size=int(rng.integers(2, 5)))) + f" [{i}]" for i in range(n)
+            ]
+            t = time.perf_counter()
+            bm25 = IndiceBM25() if rag_gratis.RAG_HIBRIDO else None
+            vectores = []
+            for i in range(0, n, LOTE_EMBEDDINGS):
+                vectores.extend(embeddings.embed_documents(textos[i:i + LOTE_EMBEDDINGS]))
+            # IVF-PQ se entrena con la muestra completa, como la ingesta con un corpus de ese tamaño
+            vs = nuevo_vectorstore(embeddings, np.asarray(vectores, dtype="float32"))
+            for i in range(0, n, LOTE_EMBEDDINGS):
+                parte = textos[i:i + LOTE_EMBEDDINGS]
+                ids = [f"s{i + j}" for j in range(len(parte))]
+                vs.add_embeddings(list(zip(parte, vectores[i:i + LOTE_EMBEDDINGS])), ids=ids)
+                if bm25 is not None:
+                    bm25.agregar(zip(ids, parte))
+            t_construccion = time.perf_counter() - t
+
+            col = Coleccion("benchmark", Path(tmp), Path(tmp))
+            col.instalar(vs, bm25)
+            motor = rag_gratis.MotorConsulta([col])
+            preguntas = [" ".join(o.split()[:8]) for o in rng.choice(oraciones, size=n_consultas)]
+            embeddings.embed_consultas(preguntas)  # los embeddings de consulta se miden aparte
+            tiempos = []
+            for p in preguntas:
+                t = time.perf_counter()
+                motor.recuperar(p)
+                tiempos.append(time.perf_counter() - t)
+            t = time.perf_counter()
+            for i in range(0, len(preguntas), lote):
+                motor.recuperar_lote(preguntas[i:i + lote])
+            t_lotes = time.perf_counter() - t
+
+            resultados.append({
+                "chunks": n,
+                "indice": describir(vs.index),
+                "construccion_s": round(t_construccion, 4),
+                "chunks_por_segundo": round(n / t_construccion, 1),
+                "consulta_individual": percentiles(tiempos),
+                f"consultas_por_segundo_lote_{lote}": round(len(preguntas) / t_lotes, 1),
+            })
+            print(f"[benchmark] recuperación con {n} chunks: {resultados[-1]['consulta_individual']}")
+    return resultados
+
+
+async def medir_punta_a_punta(concurrencias: list[int], n_requests: int) -> list[dict]:
+    import httpx
+    import database
+    import main
+    import rag_gratis
+    from models.user import User
+    from routers.auth import get_password_hash, token_de_usuario
+
+    database.crear_tablas()
+    rag_gratis.inicializar()
+    db = database.SessionLocal()
+    try:
+        usuario_bench = db.query(User).filter(User.email == "bench@local").first()
+        if usuario_bench is None:
+            usuario_bench = User(rut="0-0", nombre="bench", apellido="bench", email="bench@local",
+                                 password=get_password_hash("bench"), role="user")
+            db.add(usuario_bench)
+            db.commit()
+        # los mismos claims que /login: se mide el camino sin BD de get_current_claims
+        headers = {"Authorization": "Bearer " + token_de_usuario(usuario_bench)}
+    finally:
+        db.close()
+
+    resultados = []
+    transporte = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark", timeout=None) as cliente:
+        for c in concurrencias:
+            pendientes = iter(range(n_requests))
+            latencias: list[float] = []
+            codigos: dict[int, int] = {}
+
+            async def usuario():
+                for i in pendientes:
+                    # preguntas distintas: ni cache de respuestas ni coalescencia
+                    pregunta = f"{PREGUNTAS_BASE[i % len(PREGUNTAS_BASE)]} (consulta {c}-{i})"
+                    t = time.perf_counter()
+                    r = await cliente.post("/preguntar", json={"pregunta": pregunta}, headers=headers)
+                    latencias.append(time.perf_counter() - t)
+                    codigos[r.status_code] = codigos.get(r.status_code, 0) + 1
+
+            t = time.perf_counter()
+            await asyncio.gather(*(usuario() for _ in range(c)))
+            total = time.perf_counter() - t
+            resultados.append({
+                "concurrencia": c,
+                "requests": n_requests,
+                "segundos": round(total, 4),
+                "requests_por_segundo": round(n_requests / total, 2),
+                "latencia": percentiles(latencias),
+                "codigos": {str(k): v for k, v in sorted(codigos.items())},
+            })
+            print(f"[benchmark] concurrencia {c}: {resultados[-1]['requests_por_segundo']} req/s")
+    rag_gratis.cerrar()
+    await database.cerrar_engines()  # aiosqlite deja un hilo por conexión abierta
+    return resultados
+
+
+def ejecutar(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark offline del backend RAG.")
+    parser.add_argument("--datos", type=Path, default=BASE_DIR / "data", help="carpeta con los PDFs")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--lote", type=int, default=32, help="preguntas por recuperar_lote")
+    parser.add_argument("--concurrencias", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=200, help="requests por nivel de concurrencia")
+    parser.add_argument("--latencia-llm-ms", type=float, default=50.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--salida", type=Path, help="archivo JSON (por defecto, stdout)")
+    args = parser.parse_args(argv)
+
+    pdfs = sorted(args.datos.glob("*.pdf"))
+    if not pdfs:
+        parser.error(f"No hay PDFs en {args.datos}")
+
+    resultado = medir_todo(args, pdfs)
+    texto = json.dumps(resultado, ensure_ascii=False, indent=2)
+    if args.salida:
+        args.salida.write_text(texto, encoding="utf-8")
+        print(f"[benchmark] resultados en {args.salida}")
+    else:
+        print(texto)
+
+
+def medir_todo(args: argparse.Namespace, pdfs: list[Path]) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="rag_benchmark_") as tmp:
+        tmp = Path(tmp)
+        preparar_entorno(tmp, args)
+        dir_indice = Path(os.environ["RAG_INDEX_DIR"])
+
+        print(f"[benchmark] ingesta de {len(pdfs)} PDFs")
+        ingesta = medir_ingesta(pdfs, dir_indice)
+        carga = medir_carga(dir_indice)
+        recuperacion = medir_recuperacion(oraciones_de(pdfs), args.tamanos, args.consultas, args.lote, args.seed)
+        punta_a_punta = asyncio.run(medir_punta_a_punta(args.concurrencias, args.requests))
+
+        import faiss
+        from indices_ann import config_indice
+        import rag_gratis
+
+        return {
+            "commit": commit_actual(),
+            "fecha": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "entorno": {
+                "python": platform.python_version(),
+                "plataforma": platform.platform(),
+                "cpus": os.cpu_count(),
+                "faiss": faiss.__version__,
+            },
+            "config": {
+                "indice": config_indice(),
+                "rag_k": rag_gratis.RAG_K,
+                "hibrido": rag_gratis.RAG_HIBRIDO,
+                "candidatos": rag_gratis.RAG_CANDIDATOS,
+                "latencia_llm_ms": args.latencia_llm_ms,
+                "seed": args.seed,
+            },
+            "ingesta": ingesta,
+            "carga_indice": carga,
+            "recuperacion": recuperacion,
+            "punta_a_punta": punta_a_punta,
+        }
+
+
+if __name__ == "__main__":
+    ejecutar()
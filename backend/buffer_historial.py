@@ -0,0 +1,160 @@
+# backend/buffer_historial.py
+# Escritura diferida del historial: /preguntar encola la fila y un hilo la inserta
+# junto con otras en una sola transacción, fuera del camino del request.
+from __future__ import annotations
+import asyncio
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from metricas import medir
+from models.history import History
+
+
+class BufferHistorial:
+    def __init__(
+        self,
+        sesiones: Callable[[], Session],
+        max_lote: int = 100,
+        intervalo: float = 0.5,
+        max_pendientes: int = 10000,
+    ):
+        self.sesiones = sesiones
+        self.max_lote = max_lote
+        self.intervalo = intervalo
+        self._cola: queue.Queue[dict] = queue.Queue(maxsize=max_pendientes)
+        self._lock = threading.Lock()  # un volcado a la vez (hilo o vaciar())
+        # filas por usuario encoladas o en un volcado en curso; las lee vaciar(rut)
+        self._por_usuario: dict[str, int] = {}
+        self._lock_cuentas = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+        self._cerrado = threading.Event()
+        self.escritas = 0
+        self.lotes = 0
+        self.sincronicas = 0
+        self.perdidas = 0
+
+    def _iniciar(self) -> None:
+        if self._hilo is None:
+            with self._lock:
+                if self._hilo is None:
+                    self._hilo = threading.Thread(target=self._bucle, name="buffer-historial", daemon=True)
+                    self._hilo.start()
+
+    async def agregar(self, pregunta: str, respuesta: str, user_rut: str) -> None:
+        # la hora es la de la pregunta, no la del volcado
+        fila = {"pregunta": pregunta, "respuesta": respuesta, "user_rut": user_rut, "timestamp": datetime.utcnow()}
+        if not self._cerrado.is_set():
+            self._iniciar()
+            self._contar([fila], 1)
+            try:
+                self._cola.put_nowait(fila)
+                return
+            except queue.Full:
+                self._contar([fila], -1)
+                # la BD no da abasto: esta fila se escribe en el request (contrapresión)
+                self.sincronicas += 1
+        # en un hilo: el insert (y su reintento con espera) no frena el event loop
+        await asyncio.to_thread(self._insertar, [fila])
+
+    def _contar(self, filas: list[dict], signo: int) -> None:
+        with self._lock_cuentas:
+            for f in filas:
+                n = self._por_usuario.get(f["user_rut"], 0) + signo
+                if n > 0:
+                    self._por_usuario[f["user_rut"]] = n
+                else:
+                    self._por_usuario.pop(f["user_rut"], None)
+
+    def _tomar(self) -> list[dict]:
+        filas = []
+        while len(filas) < self.max_lote:
+            try:
+                filas.append(self._cola.get_nowait())
+            except queue.Empty:
+                break
+        return filas
+
+    @medir("historial_insert")
+    def _insertar(self, filas: list[dict]) -> None:
+        # desde el hilo solo va al histograma de /metrics; en la escritura
+        # sincrónica (cola llena) también al desglose del request
+        for intento in range(2):
+            db = self.sesiones()
+            try:
+                db.bulk_insert_mappings(History, filas)
+                db.commit()
+                self.escritas += len(filas)
+                self.lotes += 1
+                return
+            except Exception as e:
+                db.rollback()
+                print(f"[historial] Error al guardar {len(filas)} filas (intento {intento + 1}):", repr(e))
+                time.sleep(self.intervalo)
+            finally:
+                db.close()
+        self.perdidas += len(filas)
+
+    def _volcar(self, filas: list[dict]) -> None:
+        try:
+            self._insertar(filas)
+        finally:
+            self._contar(filas, -1)
+
+    def _bucle(self) -> None:
+        # las filas salen de la cola y se insertan bajo `_lock`: quien entra a
+        # vaciar() no se salta un lote que el hilo ya tomó y aún no escribió
+        # (el lock se suelta entre lotes: vaciar() espera a lo más uno)
+        while not self._cerrado.wait(self.intervalo):
+            while True:
+                with self._lock:
+                    filas = self._tomar()
+                    if not filas:
+                        break
+                    self._volcar(filas)
+
+    def vaciar(self, user_rut: Optional[str] = None) -> None:
+        """Escribe ya lo pendiente de `user_rut` (todo, sin usuario), p.ej. antes de
+        que lea su historial. Las filas de otros usuarios vuelven a la cola."""
+        if not self.pendientes(user_rut):
+            return
+        with self._lock:
+            filas: list[dict] = []
+            while lote := self._tomar():
+                filas.extend(lote)
+            if user_rut is not None:
+                otras = [f for f in filas if f["user_rut"] != user_rut]
+                filas = [f for f in filas if f["user_rut"] == user_rut]
+                for i, f in enumerate(otras):
+                    try:
+                        self._cola.put_nowait(f)
+                    except queue.Full:  # se llenó mientras tanto: van con estas
+                        filas.extend(otras[i:])
+                        break
+            for i in range(0, len(filas), self.max_lote):
+                self._volcar(filas[i:i + self.max_lote])
+
+    def pendientes(self, user_rut: Optional[str] = None) -> int:
+        if user_rut is None:
+            return self._cola.qsize()
+        with self._lock_cuentas:
+            return self._por_usuario.get(user_rut, 0)
+
+    def cerrar(self) -> None:
+        self._cerrado.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=self.intervalo * 2)
+        self.vaciar()
+
+    def estadisticas(self) -> dict:
+        return {
+            "pendientes": self.pendientes(),
+            "escritas": self.escritas,
+            "lotes": self.lotes,
+            "sincronicas": self.sincronicas,
+            "perdidas": self.perdidas,
+        }
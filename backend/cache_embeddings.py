@@ -0,0 +1,119 @@
+# backend/cache_embeddings.py
+# Cache persistente de embeddings: (modelo, hash del texto) -> vector float32.
+# Reindexar o volver a subir un PDF sin cambios no vuelve a pasar por el modelo.
+from __future__ import annotations
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    modelo TEXT NOT NULL,
+    hash BLOB NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (modelo, hash)
+) WITHOUT ROWID;
+"""
+
+
+def hash_texto(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()[:32]
+
+
+class EmbeddingsCacheados(Embeddings):
+    def __init__(self, base: Embeddings, ruta: Path, modelo: str, max_consultas: int = 1024):
+        self.base = base
+        self.ruta = ruta
+        self.modelo = modelo
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # las preguntas se embeben más de una vez por request (cache de respuestas
+        # y recuperación): LRU en memoria, no se persisten
+        self._consultas: OrderedDict[str, list[float]] = OrderedDict()
+        self.max_consultas = max_consultas
+        self.aciertos = 0
+        self.fallos = 0
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        self._conexion().executescript(_ESQUEMA)
+
+    def _conexion(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(str(self.ruta), timeout=30)
+            self._local.con = con
+        return con
+
+    def _buscar(self, claves: list[bytes]) -> dict[bytes, np.ndarray]:
+        con = self._conexion()
+        encontrados: dict[bytes, np.ndarray] = {}
+        for i in range(0, len(claves), 500):
+            lote = claves[i:i + 500]
+            marcas = ",".join("?" * len(lote))
+            filas = con.execute(
+                f"SELECT hash, vector FROM embeddings WHERE modelo = ? AND hash IN ({marcas})",
+                [self.modelo, *lote],
+            )
+            for h, v in filas:
+                encontrados[h] = np.frombuffer(v, dtype="float32")
+        return encontrados
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        claves = [bytes.fromhex(hash_texto(t)) for t in texts]
+        encontrados = self._buscar(list(set(claves)))
+
+        faltan: dict[bytes, str] = {}
+        for c, t in zip(claves, texts):
+            if c not in encontrados:
+                faltan.setdefault(c, t)  # textos repetidos se embeben una sola vez
+        if faltan:
+            vectores = self.base.embed_documents(list(faltan.values()))
+            nuevos = {c: np.asarray(v, dtype="float32") for c, v in zip(faltan, vectores)}
+            with self._lock:
+                con = self._conexion()
+                con.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                    [(self.modelo, c, v.tobytes()) for c, v in nuevos.items()],
+                )
+                con.commit()
+            encontrados.update(nuevos)
+
+        self.aciertos += len(texts) - len(faltan)
+        self.fallos += len(faltan)
+        return [encontrados[c].tolist() for c in claves]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_consultas([text])[0]
+
+    def embed_consultas(self, textos: list[str]) -> list[list[float]]:
+        """Varias preguntas en una sola llamada al modelo (las que no estén en el LRU)."""
+        with self._lock:
+            encontrados = {t: self._consultas[t] for t in textos if t in self._consultas}
+            for t in encontrados:
+                self._consultas.move_to_end(t)
+        faltan = list(dict.fromkeys(t for t in textos if t not in encontrados))
+        if len(faltan) == 1:
+            nuevos = [self.base.embed_query(faltan[0])]
+        elif faltan:
+            # MiniLM no distingue consulta de documento: el lote va por embed_documents
+            nuevos = self.base.embed_documents(faltan)
+        else:
+            nuevos = []
+        with self._lock:
+            for t, v in zip(faltan, nuevos):
+                self._consultas[t] = encontrados[t] = v
+            while len(self._consultas) > self.max_consultas:
+                self._consultas.popitem(last=False)
+        return [encontrados[t] for t in textos]
+
+    def estadisticas(self) -> dict:
+        total = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / total, 4) if total else 0.0,
+        }
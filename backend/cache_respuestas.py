@@ -0,0 +1,163 @@
+# backend/cache_respuestas.py
+# Cache de respuestas delante del LLM: coincidencia exacta por texto normalizado
+# y, si no hay, coincidencia semántica por similitud coseno de embeddings.
+from __future__ import annotations
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def normalizar_pregunta(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[¿?¡!.,;:\"']+", " ", texto)
+    return " ".join(texto.split())
+
+
+def _clave(ambito: str, pregunta: str) -> str:
+    return f"{ambito}|{normalizar_pregunta(pregunta)}" if ambito else normalizar_pregunta(pregunta)
+
+
+@dataclass
+class EntradaCache:
+    respuesta: str
+    fuentes: list
+    vector: Optional[np.ndarray]
+    ambito: str = ""
+    creado: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class ResultadoCache:
+    respuesta: Optional[str]
+    fuentes: list
+    vector: Optional[np.ndarray]  # embedding ya calculado, para reutilizarlo al guardar
+    version: int
+
+    @property
+    def acierto(self) -> bool:
+        return self.respuesta is not None
+
+
+class CacheRespuestas:
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        umbral: float = 0.92,
+        max_entradas: int = 512,
+        ttl_segundos: float = 3600,
+    ):
+        self.embeddings = embeddings
+        self.umbral = umbral
+        self.max_entradas = max_entradas
+        self.ttl = ttl_segundos
+        self._entradas: OrderedDict[str, EntradaCache] = OrderedDict()
+        self._lock = threading.Lock()
+        self._matriz: Optional[np.ndarray] = None  # vectores apilados, se recalcula al cambiar
+        self._claves_matriz: list[str] = []
+        self._ambitos_matriz: np.ndarray = np.empty(0, dtype=object)
+        # cada invalidación sube la versión: una respuesta calculada con el
+        # índice anterior no se guarda aunque termine después
+        self.version = 0
+        self.aciertos_exactos = 0
+        self.aciertos_semanticos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def _vigente(self, e: EntradaCache, ahora: float) -> bool:
+        return self.ttl <= 0 or ahora - e.creado < self.ttl
+
+    def _purgar_expiradas(self, ahora: float) -> None:
+        vencidas = [k for k, e in self._entradas.items() if not self._vigente(e, ahora)]
+        for k in vencidas:
+            del self._entradas[k]
+        if vencidas:
+            self._matriz = None
+
+    def _embedding(self, texto: str) -> np.ndarray:
+        v = np.asarray(self.embeddings.embed_query(texto), dtype="float32")
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    def buscar(self, pregunta: str, vector: Optional[np.ndarray] = None, ambito: str = "") -> ResultadoCache:
+        """`vector`: embedding de la pregunta si ya se calculó (p.ej. en un lote).
+        `ambito`: las colecciones consultadas; solo acierta contra entradas del mismo."""
+        clave = _clave(ambito, pregunta)
+        with self._lock:
+            version = self.version
+            ahora = time.monotonic()
+            e = self._entradas.get(clave)
+            if e is not None and self._vigente(e, ahora):
+                self._entradas.move_to_end(clave)
+                self.aciertos_exactos += 1
+                return ResultadoCache(e.respuesta, e.fuentes, e.vector, version)
+
+        # el embedding se calcula fuera del lock
+        if vector is None:
+            vector = self._embedding(normalizar_pregunta(pregunta))
+        else:
+            n = np.linalg.norm(vector)
+            vector = vector / n if n else vector
+
+        with self._lock:
+            ahora = time.monotonic()
+            self._purgar_expiradas(ahora)
+            if self._entradas and version == self.version:
+                if self._matriz is None:
+                    self._claves_matriz = [k for k, x in self._entradas.items() if x.vector is not None]
+                    self._ambitos_matriz = np.array([self._entradas[k].ambito for k in self._claves_matriz], dtype=object)
+                    self._matriz = (
+                        np.stack([self._entradas[k].vector for k in self._claves_matriz])
+                        if self._claves_matriz else np.empty((0, vector.shape[0]), dtype="float32")
+                    )
+                if len(self._claves_matriz):
+                    sims = np.where(self._ambitos_matriz == ambito, self._matriz @ vector, -np.inf)
+                    i = int(np.argmax(sims))
+                    if sims[i] >= self.umbral:
+                        k = self._claves_matriz[i]
+                        e = self._entradas[k]
+                        self._entradas.move_to_end(k)
+                        self.aciertos_semanticos += 1
+                        return ResultadoCache(e.respuesta, e.fuentes, vector, version)
+            self.fallos += 1
+            return ResultadoCache(None, [], vector, version)
+
+    def guardar(self, pregunta: str, respuesta: str, fuentes: list, previo: ResultadoCache, ambito: str = "") -> None:
+        clave = _clave(ambito, pregunta)
+        with self._lock:
+            if previo.version != self.version:
+                return
+            self._entradas[clave] = EntradaCache(respuesta, fuentes, previo.vector, ambito)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+            self._matriz = None
+
+    def invalidar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+            self._matriz = None
+            self.version += 1
+            self.invalidaciones += 1
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            aciertos = self.aciertos_exactos + self.aciertos_semanticos
+            total = aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "aciertos": aciertos,
+                "aciertos_exactos": self.aciertos_exactos,
+                "aciertos_semanticos": self.aciertos_semanticos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(aciertos / total, 4) if total else 0.0,
+                "invalidaciones": self.invalidaciones,
+                "umbral": self.umbral,
+            }
@@ -0,0 +1,229 @@
+# backend/colecciones.py
+# Colecciones de documentos con nombre (p.ej. una por departamento). Cada una es un
+# shard: su carpeta de PDFs, su índice FAISS, su BM25 y su manifiesto. Se cargan al
+# consultarlas y las menos usadas se descargan si se pasa el presupuesto de memoria.
+from __future__ import annotations
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+from langchain_community.vectorstores import FAISS
+
+import almacen
+from concurrencia import LockArchivo, LockLecturaEscritura
+from indexador import Manifiesto
+from indices_ann import describir
+from recuperacion import IndiceBM25
+
+GENERAL = "general"  # la colección de siempre: data/ y faiss_store/ sin subcarpeta
+NOMBRE_VALIDO = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+
+class ColeccionInvalida(ValueError):
+    pass
+
+
+class Coleccion:
+    def __init__(self, nombre: str, data_dir: Path, index_dir: Path):
+        self.nombre = nombre
+        self.data_dir = data_dir
+        self.index_dir = index_dir
+        self.manifiesto = Manifiesto(self.manifiesto_path, splitter={})
+        self.vectorstore: Optional[FAISS] = None
+        self.bm25: Optional[IndiceBM25] = None
+        self.cargada = False
+        # búsquedas (lector) frente a cambios del índice (escritor), como lock_indice antes
+        self.lock = LockLecturaEscritura()
+        # un solo trabajo de ingesta modifica índice+manifiesto de la colección a la vez
+        self.escritor = threading.Lock()
+        # ... y un solo proceso: los workers de uvicorn comparten el directorio
+        self.lock_disco = LockArchivo(index_dir / "escritura.lock")
+        self._carga = threading.Lock()
+        self.ultimo_uso = 0.0
+        self.mtime_manifiesto = 0.0
+        self.mapeada = False  # índice abierto con mmap: de solo lectura
+        self.en_ingesta = False  # la carga debe quedar modificable (sin mmap)
+        # consultas en curso que la necesitan (GestorColecciones.fijar): no se descarga
+        self.fijada = 0
+
+    @property
+    def manifiesto_path(self) -> Path:
+        return self.index_dir / "manifiesto.json"
+
+    @property
+    def bm25_path(self) -> Path:
+        return self.index_dir / "bm25.json"
+
+    def pdfs(self) -> list[Path]:
+        return sorted(self.data_dir.glob("*.pdf")) if self.data_dir.exists() else []
+
+    def tiene_indice(self) -> bool:
+        # sin cargarla: basta con que el índice esté en disco
+        return self.vectorstore is not None if self.cargada else almacen.existe(self.index_dir)
+
+    def instalar(self, vs: Optional[FAISS], bm25: Optional[IndiceBM25]) -> None:
+        # las búsquedas leen vectorstore y bm25 juntos bajo el lado lector
+        with self.lock.escritura():
+            self.vectorstore = vs
+            self.bm25 = bm25
+            self.cargada = True
+
+    def memoria(self) -> int:
+        return describir(getattr(self.vectorstore, "index", None))["memoria_bytes"]
+
+    def describir(self) -> dict:
+        return {
+            "cargada": self.cargada,
+            "pdfs": len(self.pdfs()),
+            "documentos": len(self.manifiesto.documentos) if self.cargada else None,
+            "indice": describir(getattr(self.vectorstore, "index", None)) if self.cargada else None,
+            "ultimo_uso": self.ultimo_uso or None,
+            "consultas_en_curso": self.fijada,
+        }
+
+
+class GestorColecciones:
+    """Registro de colecciones. `cargar(col)` lee el índice de disco y lo instala
+    con `col.instalar`; lo provee rag_gratis (necesita el modelo de embeddings).
+
+    `presupuesto_bytes` es un límite blando: nunca se descarga una colección fijada
+    por una consulta en curso ni una con un trabajo de ingesta activo.
+    """
+
+    def __init__(self, data_dir: Path, index_dir: Path, cargar: Callable[[Coleccion], None], presupuesto_bytes: int = 0):
+        self.data_dir = data_dir
+        self.index_dir = index_dir
+        self._cargar = cargar
+        self.presupuesto = presupuesto_bytes
+        self._colecciones: dict[str, Coleccion] = {}
+        self._lock = threading.Lock()
+        self.cargas = 0
+        self.descargas = 0
+
+    def _rutas(self, nombre: str) -> tuple[Path, Path]:
+        if nombre == GENERAL:
+            return self.data_dir, self.index_dir
+        return self.data_dir / nombre, self.index_dir / "colecciones" / nombre
+
+    def validar(self, nombre: str) -> str:
+        nombre = (nombre or "").strip().lower()
+        if not NOMBRE_VALIDO.match(nombre):
+            raise ColeccionInvalida(f"Nombre de colección inválido: '{nombre}' (a-z, 0-9, '_' y '-')")
+        return nombre
+
+    def nombres(self) -> list[str]:
+        """Las registradas más las que hay en disco (p.ej. creadas por otro worker)."""
+        encontrados = {GENERAL, *self._colecciones}
+        for base in (self.data_dir, self.index_dir / "colecciones"):
+            if base.exists():
+                encontrados.update(p.name for p in base.iterdir() if p.is_dir() and NOMBRE_VALIDO.match(p.name))
+        return sorted(encontrados)
+
+    def obtener(self, nombre: str, crear: bool = False) -> Optional[Coleccion]:
+        nombre = self.validar(nombre)
+        with self._lock:
+            col = self._colecciones.get(nombre)
+            if col is None:
+                data_dir, index_dir = self._rutas(nombre)
+                if not (crear or nombre == GENERAL or data_dir.exists() or index_dir.exists()):
+                    return None
+                col = self._colecciones[nombre] = Coleccion(nombre, data_dir, index_dir)
+            return col
+
+    def registradas(self) -> list[Coleccion]:
+        with self._lock:
+            return list(self._colecciones.values())
+
+    def asegurar_cargada(self, col: Coleccion) -> Coleccion:
+        col.ultimo_uso = time.monotonic()
+        if not col.cargada:
+            with col._carga:
+                if not col.cargada:
+                    self._cargar(col)
+                    self.cargas += 1
+        return col
+
+    def recargar(self, col: Coleccion) -> bool:
+        """Vuelve a leer de disco una colección cargada (p.ej. la escribió otro worker)."""
+        with col._carga:
+            if not col.cargada:
+                return False
+            self._cargar(col)
+            return True
+
+    def cargar_varias(self, nombres: list[str]) -> list[Coleccion]:
+        """Carga (si hace falta) las colecciones de un trabajo de ingesta y después
+        ajusta la memoria sin tocar ninguna de ellas."""
+        cols = [self.asegurar_cargada(self.obtener(n, crear=True)) for n in nombres]
+        self.ajustar_memoria(excepto={c.nombre for c in cols})
+        return cols
+
+    @contextmanager
+    def fijar(self, nombres: list[str]):
+        """Carga las colecciones de una consulta y las mantiene en memoria hasta que
+        termina la recuperación, aunque otra consulta ajuste la memoria entretanto."""
+        cols = [self.obtener(n, crear=True) for n in nombres]
+        with self._lock:
+            for col in cols:
+                col.fijada += 1
+        try:
+            # fijada antes de mirar `cargada`: una descarga posterior ya no la toca
+            for col in cols:
+                self.asegurar_cargada(col)
+            self.ajustar_memoria()
+            yield cols
+        finally:
+            with self._lock:
+                for col in cols:
+                    col.fijada -= 1
+
+    def ajustar_memoria(self, excepto: set = frozenset()) -> None:
+        if self.presupuesto <= 0:
+            return
+        cargadas = [c for c in self.registradas() if c.cargada]
+        total = sum(c.memoria() for c in cargadas)
+        # las menos usadas primero
+        for col in sorted(cargadas, key=lambda c: c.ultimo_uso):
+            if total <= self.presupuesto:
+                return
+            if col.nombre in excepto:
+                continue
+            memoria = col.memoria()
+            if self.descargar(col):
+                total -= memoria
+        if total > self.presupuesto:
+            print(f"[colecciones] {total} bytes cargados superan el presupuesto de {self.presupuesto}.")
+
+    def descargar(self, col: Coleccion) -> bool:
+        # con un trabajo de ingesta en curso la colección queda cargada
+        if not col.escritor.acquire(blocking=False):
+            return False
+        try:
+            with col._carga:
+                with self._lock:
+                    if col.fijada:
+                        return False
+                    # desde aquí quien la fije la vuelve a cargar (espera `_carga`)
+                    col.cargada = False
+                with col.lock.escritura():
+                    col.vectorstore = None
+                    col.bm25 = None
+            self.descargas += 1
+            print(f"[colecciones] '{col.nombre}' descargada de memoria.")
+            return True
+        finally:
+            col.escritor.release()
+
+    def estadisticas(self) -> dict:
+        cols = {n: self.obtener(n).describir() for n in self.nombres()}
+        return {
+            "colecciones": cols,
+            "cargadas": sum(1 for c in cols.values() if c["cargada"]),
+            "memoria_bytes": sum(c.memoria() for c in self.registradas() if c.cargada),
+            "presupuesto_bytes": self.presupuesto,
+            "cargas": self.cargas,
+            "descargas": self.descargas,
+        }
@@ -0,0 +1,176 @@
+# backend/concurrencia.py
+from __future__ import annotations
+import asyncio
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos (usar un solo worker)
+    fcntl = None
+
+
+class LockLecturaEscritura:
+    """Muchos lectores o un escritor. Un escritor en espera bloquea a los lectores
+    nuevos, para que una ráfaga de consultas no deje sin turno a la ingesta."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._lectores = 0
+        self._escribiendo = False
+        self._escritores_esperando = 0
+
+    @contextmanager
+    def lectura(self):
+        with self._cond:
+            while self._escribiendo or self._escritores_esperando:
+                self._cond.wait()
+            self._lectores += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._lectores -= 1
+                if not self._lectores:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def escritura(self):
+        with self._cond:
+            self._escritores_esperando += 1
+            try:
+                while self._escribiendo or self._lectores:
+                    self._cond.wait()
+            finally:
+                self._escritores_esperando -= 1
+            self._escribiendo = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._escribiendo = False
+                self._cond.notify_all()
+
+
+class LockArchivo:
+    """Lock exclusivo entre procesos: `flock` sobre `ruta`, p.ej. para que un solo
+    worker de uvicorn a la vez escriba un índice. Cada `tomar()` abre su propio
+    descriptor, así que también excluye a otros hilos del mismo proceso. El sistema
+    lo suelta si el proceso muere. Sin fcntl no excluye a nadie."""
+
+    entre_procesos = fcntl is not None
+
+    def __init__(self, ruta: Path):
+        self.ruta = ruta
+
+    @contextmanager
+    def tomar(self, bloquear: bool = True):
+        """Entrega True con el lock tomado; con `bloquear=False`, False si otro lo tiene."""
+        if fcntl is None:
+            yield True
+            return
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.ruta, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if bloquear else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+
+class Saturado(Exception):
+    def __init__(self, mensaje: str, reintentar: int, posicion: Optional[int] = None):
+        super().__init__(mensaje)
+        self.reintentar = reintentar  # segundos sugeridos para Retry-After
+        self.posicion = posicion
+
+
+class LimitadorAsync:
+    """Semáforo con cola acotada delante de un recurso lento (el LLM).
+
+    Como mucho `concurrencia` turnos a la vez y `max_cola` esperando; el resto se
+    rechaza de inmediato (Saturado, posición = max_cola). Quien espera más de
+    `espera_max` segundos también se rechaza. El Retry-After se estima con la
+    duración media de los turnos recientes.
+    """
+
+    def __init__(self, concurrencia: int, max_cola: int, espera_max: float, duracion_inicial: float = 10.0):
+        self.concurrencia = max(1, concurrencia)
+        self.max_cola = max_cola
+        self.espera_max = espera_max
+        self.en_curso = 0
+        self.esperando = 0
+        self.rechazados = 0
+        self.duracion_media = duracion_inicial
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._loop = None
+
+    def _semaforo(self) -> asyncio.Semaphore:
+        # un semáforo por event loop: asyncio.Semaphore queda atado al primer loop que lo usa
+        # y benchmark.py corre su propio loop con asyncio.run, distinto al de uvicorn
+        loop = asyncio.get_running_loop()
+        if self._sem is None or self._loop is not loop:
+            self._sem = asyncio.Semaphore(self.concurrencia)
+            self._loop = loop
+        return self._sem
+
+    def estimar_espera(self, posicion: int) -> int:
+        return max(1, math.ceil(self.duracion_media * posicion / self.concurrencia))
+
+    async def entrar(self) -> float:
+        """Espera un turno; devuelve el instante de entrada para `salir`."""
+        sem = self._semaforo()
+        if sem.locked():
+            if self.esperando >= self.max_cola:
+                self.rechazados += 1
+                posicion = self.esperando + 1
+                raise Saturado(f"Hay {self.esperando} consultas en espera", self.estimar_espera(posicion), posicion)
+            self.esperando += 1
+            try:
+                await asyncio.wait_for(sem.acquire(), timeout=self.espera_max)
+            except asyncio.TimeoutError:
+                self.rechazados += 1
+                raise Saturado(
+                    f"Sin turno después de {self.espera_max:.0f}s", self.estimar_espera(self.esperando)
+                )
+            finally:
+                self.esperando -= 1
+        else:
+            await sem.acquire()
+        self.en_curso += 1
+        return time.monotonic()
+
+    def salir(self, inicio: float) -> None:
+        self.en_curso -= 1
+        self.duracion_media = 0.8 * self.duracion_media + 0.2 * (time.monotonic() - inicio)
+        self._sem.release()
+
+    @asynccontextmanager
+    async def turno(self):
+        inicio = await self.entrar()
+        try:
+            yield
+        finally:
+            self.salir(inicio)
+
+    def estadisticas(self) -> dict:
+        return {
+            "concurrencia": self.concurrencia,
+            "en_curso": self.en_curso,
+            "esperando": self.esperando,
+            "max_cola": self.max_cola,
+            "rechazados": self.rechazados,
+            "duracion_media_s": round(self.duracion_media, 3),
+        }
@@ -5,6 +5,17 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    AUTH_CACHE_TTL: float = 60  # segundos que se reutiliza un usuario ya leído de la BD
+    # contraseñas: costo bcrypt (al cambiarlo, los hashes se rehacen en el próximo login)
+    AUTH_BCRYPT_ROUNDS: int = 12
+    AUTH_HASH_WORKERS: int = 2  # procesos para bcrypt; 0 = en un hilo del proceso web
+    AUTH_HASH_MAX_COLA: int = 64
+    AUTH_HASH_ESPERA_MAX: float = 10
+    # freno de logins fallidos por ventana deslizante (0 = sin límite)
+    AUTH_LOGIN_MAX_FALLOS_CUENTA: int = 5
+    AUTH_LOGIN_MAX_FALLOS_IP: int = 50
+    AUTH_LOGIN_VENTANA: float = 300
+    AUTH_IP_DESDE_PROXY: bool = False  # tomar la IP de X-Forwarded-For (solo detrás de un proxy propio)
 
     class Config:
         env_file = ".env"
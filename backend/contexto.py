@@ -0,0 +1,112 @@
+# backend/contexto.py
+# Armado del contexto que va al prompt: une chunks vecinos de la misma página
+# (el splitter los solapa en CHUNK_OVERLAP caracteres), descarta casi-duplicados
+# y corta todo a un presupuesto de tokens y de fragmentos.
+from __future__ import annotations
+import math
+import os
+import re
+
+from langchain_core.documents import Document
+
+# ~3 chunks de 500 caracteres: el prefill de Ollama en CPU crece con cada token
+MAX_TOKENS = int(os.getenv("RAG_CONTEXTO_MAX_TOKENS", "450"))
+# sin el tokenizer de qwen2.5 a mano: en español rinde ~3.5 caracteres por token
+CHARS_POR_TOKEN = float(os.getenv("RAG_CONTEXTO_CHARS_POR_TOKEN", "3.5"))
+UMBRAL_DUPLICADO = float(os.getenv("RAG_CONTEXTO_UMBRAL_DUPLICADO", "0.8"))
+MIN_SOLAPE = 20  # caracteres en común para considerar que dos chunks son contiguos
+
+
+def estimar_tokens(texto: str) -> int:
+    return math.ceil(len(texto) / CHARS_POR_TOKEN)
+
+
+def _pagina(d: Document) -> tuple:
+    return d.metadata.get("source") or d.metadata.get("archivo"), d.metadata.get("page")
+
+
+def _solape(a: str, b: str) -> int:
+    """Largo del sufijo más largo de `a` que es prefijo de `b` (al menos MIN_SOLAPE).
+    Solo se verifica donde aparece el comienzo de `b` en `a`, no cada largo posible."""
+    cabeza = b[:MIN_SOLAPE]
+    if len(cabeza) < MIN_SOLAPE:
+        return 0
+    i = a.find(cabeza, max(0, len(a) - len(b)))
+    while i != -1:
+        if b.startswith(a[i:]):
+            return len(a) - i
+        i = a.find(cabeza, i + 1)
+    return 0
+
+
+def _unir(a: str, b: str) -> str | None:
+    if b in a:
+        return a
+    if a in b:
+        return b
+    n = _solape(a, b)
+    if n:
+        return a + b[n:]
+    n = _solape(b, a)
+    if n:
+        return b + a[n:]
+    return None
+
+
+def _shingles(texto: str, n: int = 3) -> set:
+    palabras = re.findall(r"\w+", texto.lower())
+    return {tuple(palabras[i:i + n]) for i in range(max(1, len(palabras) - n + 1))}
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def ensamblar(
+    docs: list[Document],
+    max_tokens: int = MAX_TOKENS,
+    umbral_duplicado: float = UMBRAL_DUPLICADO,
+    max_fragmentos: int = 0,
+) -> list[Document]:
+    """`docs` viene ordenado por relevancia y así se devuelve: cada fragmento unido
+    queda en la posición del mejor de sus chunks. Entran fragmentos hasta llenar
+    `max_tokens` o juntar `max_fragmentos`, lo que ocurra antes (<= 0: sin tope)."""
+    # 1) unir chunks de la misma página que se solapan o se contienen
+    unidos: list[Document] = []
+    for d in docs:
+        texto = d.page_content
+        for i, u in enumerate(unidos):
+            if _pagina(u) == _pagina(d):
+                junto = _unir(u.page_content, texto)
+                if junto is not None:
+                    unidos[i] = Document(id=u.id, page_content=junto, metadata=u.metadata)
+                    break
+        else:
+            unidos.append(d)
+
+    # 2) casi-duplicados (p.ej. el mismo párrafo en dos PDFs): queda el mejor rankeado
+    distintos: list[tuple[Document, set]] = []
+    for d in unidos:
+        s = _shingles(d.page_content)
+        if all(_jaccard(s, otro) < umbral_duplicado for _, otro in distintos):
+            distintos.append((d, s))
+
+    # 3) presupuesto de tokens; el último fragmento que no cabe entero se recorta
+    distintos = distintos[: max_fragmentos if max_fragmentos > 0 else None]
+    if max_tokens <= 0:
+        return [d for d, _ in distintos]
+    salida: list[Document] = []
+    restante = max_tokens
+    for d, _ in distintos:
+        costo = estimar_tokens(d.page_content)
+        if costo <= restante:
+            salida.append(d)
+            restante -= costo
+            continue
+        chars = int(restante * CHARS_POR_TOKEN)
+        if chars >= 200:  # un recorte más corto no aporta
+            corte = d.page_content[:chars]
+            corte = corte[: corte.rfind(" ")] if " " in corte else corte
+            salida.append(Document(id=d.id, page_content=corte + " …", metadata=d.metadata))
+        break
+    return salida
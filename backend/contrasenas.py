@@ -0,0 +1,188 @@
+# backend/contrasenas.py
+# bcrypt fuera del proceso web: hashear y verificar contraseñas corre en un pool de
+# procesos acotado, así una ráfaga de logins no ocupa los hilos ni el GIL que usan
+# las consultas. También el freno de intentos de login por IP y por cuenta.
+# Este módulo se importa en los procesos hijos: solo dependencias livianas.
+from __future__ import annotations
+import asyncio
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from passlib.hash import bcrypt
+
+from concurrencia import LimitadorAsync
+
+_ficticios: dict[int, str] = {}  # por proceso: hash para comparar cuando el usuario no existe
+
+
+def rondas(hashed: str) -> Optional[int]:
+    """Costo de un hash bcrypt ($2b$12$...); None si no es bcrypt."""
+    try:
+        prefijo, costo = hashed.split("$")[1:3]
+        return int(costo) if prefijo.startswith("2") else None
+    except (AttributeError, ValueError):
+        return None
+
+
+def hashear_sync(password: str, costo: int) -> str:
+    return bcrypt.using(rounds=costo).hash(password)
+
+
+def verificar_sync(password: str, hashed: Optional[str], costo: int) -> tuple[bool, Optional[str]]:
+    """(coincide, hash nuevo). El hash nuevo viene cuando coincide pero se hizo con
+    otro costo que el configurado. Sin hash (usuario inexistente) se compara igual
+    contra uno ficticio, para que la respuesta tarde lo mismo."""
+    if hashed is None:
+        if costo not in _ficticios:
+            _ficticios[costo] = hashear_sync("", costo)
+        bcrypt.verify(" ", _ficticios[costo])
+        return False, None
+    try:
+        ok = bcrypt.verify(password, hashed)
+    except ValueError:  # no es un hash bcrypt válido
+        return False, None
+    if ok and rondas(hashed) != costo:
+        return True, hashear_sync(password, costo)
+    return ok, None
+
+
+def _listo() -> bool:
+    return True
+
+
+class PoolContrasenas:
+    """`workers` procesos (0 = un hilo del threadpool, para desarrollo). Delante va un
+    LimitadorAsync: como mucho `workers` tareas en el pool, `max_cola` esperando y
+    el resto se rechaza con Saturado."""
+
+    def __init__(self, workers: int, costo: int, max_cola: int = 64, espera_max: float = 10):
+        self.workers = workers
+        self.costo = costo
+        self.limitador = LimitadorAsync(max(1, workers), max_cola, espera_max, duracion_inicial=0.3)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.hashes = 0
+        self.verificaciones = 0
+        self.actualizados = 0
+        self.reinicios = 0
+
+    def _ejecutor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: el proceso web tiene hilos (torch, FAISS) y fork con hilos no es seguro
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def iniciar(self) -> None:
+        # levanta los procesos ahora y no en el primer login
+        if self.workers > 0:
+            pool = self._ejecutor()
+            for _ in range(self.workers):
+                pool.submit(_listo)
+
+    async def _ejecutar(self, fn, *args):
+        async with self.limitador.turno():
+            if self.workers <= 0:
+                return await asyncio.to_thread(fn, *args)
+            pool = self._ejecutor()
+            try:
+                return await asyncio.wrap_future(pool.submit(fn, *args))
+            except BrokenProcessPool:
+                # un hijo murió (p.ej. OOM): se rehace el pool y se reintenta una vez
+                with self._lock:
+                    if self._pool is pool:
+                        self._pool = None
+                        self.reinicios += 1
+                pool.shutdown(wait=False)
+                print("[contraseñas] Pool de procesos roto, se vuelve a crear.")
+                return await asyncio.wrap_future(self._ejecutor().submit(fn, *args))
+
+    async def hashear(self, password: str) -> str:
+        self.hashes += 1
+        return await self._ejecutar(hashear_sync, password, self.costo)
+
+    async def verificar(self, password: str, hashed: Optional[str]) -> tuple[bool, Optional[str]]:
+        self.verificaciones += 1
+        ok, nuevo = await self._ejecutar(verificar_sync, password, hashed, self.costo)
+        if nuevo:
+            self.actualizados += 1
+        return ok, nuevo
+
+    def cerrar(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def estadisticas(self) -> dict:
+        return {
+            "workers": self.workers,
+            "costo": self.costo,
+            "hashes": self.hashes,
+            "verificaciones": self.verificaciones,
+            "actualizados": self.actualizados,
+            "reinicios": self.reinicios,
+            **{k: v for k, v in self.limitador.estadisticas().items() if k in ("en_curso", "esperando", "rechazados")},
+        }
+
+
+class IntentosLogin:
+    """Ventana deslizante de logins fallidos por IP y por cuenta. Solo cuentan los
+    fallos: un curso entero entrando desde la misma IP no se frena. Cada worker
+    lleva su propia cuenta, así que el límite efectivo se multiplica por workers."""
+
+    def __init__(self, max_ip: int, max_cuenta: int, ventana: float):
+        self.max_ip = max_ip
+        self.max_cuenta = max_cuenta
+        self.ventana = ventana
+        self._fallos: dict[tuple[str, str], deque] = {}
+        self._lock = threading.Lock()
+        self.bloqueos = {"ip": 0, "cuenta": 0}
+
+    def _vigentes(self, clave: tuple[str, str], ahora: float) -> Optional[deque]:
+        fallos = self._fallos.get(clave)
+        if fallos is None:
+            return None
+        while fallos and fallos[0] <= ahora - self.ventana:
+            fallos.popleft()
+        if not fallos:
+            del self._fallos[clave]
+            return None
+        return fallos
+
+    def espera(self, ip: str, cuenta: str) -> tuple[int, Optional[str]]:
+        """(segundos para reintentar, motivo); (0, None) si puede intentar."""
+        ahora = time.monotonic()
+        with self._lock:
+            for motivo, valor, maximo in (("cuenta", cuenta, self.max_cuenta), ("ip", ip, self.max_ip)):
+                if maximo <= 0:
+                    continue
+                fallos = self._vigentes((motivo, valor), ahora)
+                if fallos is not None and len(fallos) >= maximo:
+                    self.bloqueos[motivo] += 1
+                    # se libera cuando el fallo que completa el máximo sale de la ventana
+                    return max(1, int(fallos[-maximo] + self.ventana - ahora) + 1), motivo
+        return 0, None
+
+    def fallo(self, ip: str, cuenta: str) -> None:
+        ahora = time.monotonic()
+        with self._lock:
+            for clave in (("ip", ip), ("cuenta", cuenta)):
+                self._fallos.setdefault(clave, deque(maxlen=max(self.max_ip, self.max_cuenta, 1))).append(ahora)
+            if len(self._fallos) > 10000:
+                # limpieza de claves viejas para que no crezca sin fin
+                for clave in list(self._fallos):
+                    self._vigentes(clave, ahora)
+
+    def exito(self, cuenta: str) -> None:
+        with self._lock:
+            self._fallos.pop(("cuenta", cuenta), None)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {"claves": len(self._fallos), "bloqueos": dict(self.bloqueos)}
@@ -1,22 +1,124 @@
 # database.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 from dotenv import load_dotenv
+import metricas
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# --- pool de conexiones (por engine: cada worker tiene el suyo) ---
+# DB_STATEMENT_TIMEOUT_MS corta en el servidor las consultas colgadas (PostgreSQL);
+# en SQLite es la espera máxima por el lock de escritura.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+
+def url_async(url: str) -> str:
+    """El mismo DATABASE_URL con el driver async: asyncpg o aiosqlite."""
+    u = make_url(url)
+    driver = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}.get(u.get_backend_name())
+    if driver is None:
+        raise ValueError(f"Sin driver async para '{u.get_backend_name()}': define DATABASE_URL_ASYNC")
+    return u.set(drivername=f"{u.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+def _opciones(url: str, asincrono: bool) -> dict:
+    u = make_url(url)
+    opciones = {"pool_pre_ping": POOL_PRE_PING}
+    if u.get_backend_name() == "sqlite":
+        opciones["connect_args"] = {"timeout": STATEMENT_TIMEOUT_MS / 1000}
+        if u.database in (None, "", ":memory:"):
+            return opciones  # una sola conexión en memoria: sin pool configurable
+    else:
+        if u.get_backend_name() == "postgresql":
+            if asincrono:
+                opciones["connect_args"] = {"server_settings": {"statement_timeout": str(STATEMENT_TIMEOUT_MS)}}
+            else:
+                opciones["connect_args"] = {"options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"}
+        opciones["pool_recycle"] = POOL_RECYCLE
+    opciones.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+    return opciones
+
+# sync: scripts, creación de tablas y el hilo del historial (buffer_historial)
+engine = create_engine(DATABASE_URL, **_opciones(DATABASE_URL, asincrono=False))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# async: los endpoints; no ocupan un hilo del threadpool mientras esperan a la BD
+DATABASE_URL_ASYNC = os.getenv("DATABASE_URL_ASYNC") or url_async(DATABASE_URL)
+async_engine = create_async_engine(DATABASE_URL_ASYNC, **_opciones(DATABASE_URL_ASYNC, asincrono=True))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 from models.user import User
-from models.history import History
+from models.history import FTS_INDICE, History
+
+# --- uso de los pools (se exponen en /metrics) ---
+eventos_pool = {("sync", "conexion"): 0, ("sync", "invalidada"): 0, ("async", "conexion"): 0, ("async", "invalidada"): 0}
+
+def _contar_eventos(motor, nombre: str) -> None:
+    def conexion(*_):
+        eventos_pool[(nombre, "conexion")] += 1
+    def invalidada(*_):
+        # p.ej. pre-ping que encontró la conexión muerta
+        eventos_pool[(nombre, "invalidada")] += 1
+    event.listen(motor, "connect", conexion)
+    event.listen(motor, "invalidate", invalidada)
+
+_contar_eventos(engine, "sync")
+_contar_eventos(async_engine.sync_engine, "async")
+
+def estado_pools() -> dict:
+    estado = {}
+    for nombre, pool in (("sync", engine.pool), ("async", async_engine.sync_engine.pool)):
+        estado[nombre] = {
+            "clase": type(pool).__name__,
+            # solo los QueuePool tienen tamaño y desborde
+            "tamano": pool.size() if hasattr(pool, "size") else None,
+            "en_uso": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "libres": pool.checkedin() if hasattr(pool, "checkedin") else None,
+            "desborde": max(pool.overflow(), 0) if hasattr(pool, "overflow") else None,
+            "conexiones_abiertas": eventos_pool[(nombre, "conexion")],
+            "invalidadas": eventos_pool[(nombre, "invalidada")],
+        }
+    return estado
 
-Base.metadata.create_all(bind=engine)
+def _pools_metricas() -> dict:
+    valores = {}
+    for nombre, estado in estado_pools().items():
+        for clave in ("en_uso", "libres", "desborde"):
+            if estado[clave] is not None:
+                valores[(nombre, clave)] = estado[clave]
+    return valores
+
+metricas.Medidor("rag_db_pool_conexiones", "Conexiones de cada pool por estado.", _pools_metricas,
+                 etiquetas=("engine", "estado"))
+metricas.Medidor("rag_db_pool_eventos_total", "Conexiones abiertas e invalidadas por pool.", lambda: dict(eventos_pool),
+                 etiquetas=("engine", "evento"), tipo="counter")
+
+# se llama al iniciar la app (en segundo plano), no al importar este módulo
+estado_tablas = {"creadas": False, "error": None}
+
+def crear_tablas():
+    try:
+        Base.metadata.create_all(bind=engine)
+        # create_all no agrega índices nuevos a tablas que ya existían
+        for indice in History.__table__.indexes:
+            indice.create(bind=engine, checkfirst=True)
+        if engine.dialect.name == "postgresql":
+            with engine.begin() as con:
+                con.execute(text(FTS_INDICE))
+        estado_tablas.update(creadas=True, error=None)
+    except Exception as e:
+        print("[DB] Error al crear tablas:", repr(e))
+        estado_tablas["error"] = f"{type(e).__name__}: {e}"
 
 def get_db():
     db = SessionLocal()
@@ -24,3 +126,11 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def cerrar_engines() -> None:
+    await async_engine.dispose()
+    engine.dispose()
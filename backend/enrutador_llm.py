@@ -0,0 +1,283 @@
+# backend/enrutador_llm.py
+# Reparte las generaciones entre varios servidores Ollama: al que tenga menos
+# requests en curso, saltando los caídos o lentos. Un hilo revisa la salud de cada
+# uno (GET /api/tags) y precarga los modelos con keep_alive al iniciar y cuando un
+# servidor vuelve a estar sano. Con la cola larga se usa un modelo de respaldo más
+# chico, si está configurado y algún servidor disponible lo tiene.
+from __future__ import annotations
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Optional
+
+import httpx
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable
+
+
+def _sin_modelo(e: Exception) -> bool:
+    # Ollama responde 404 si el servidor no tiene el modelo: no es una caída
+    return getattr(e, "status_code", None) == 404
+
+
+class Backend:
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.en_curso = 0
+        self.sano = True  # hasta el primer chequeo se asume que responde
+        self.expulsado_hasta = 0.0
+        self.fallos_seguidos = 0
+        self.completadas = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.latencia_salud: Optional[float] = None  # segundos, EWMA
+        self.modelos: Optional[set[str]] = None  # los que tiene descargados; None = no se sabe
+        self._cadenas: dict[str, Runnable] = {}
+
+    def disponible(self, ahora: float) -> bool:
+        return self.sano and ahora >= self.expulsado_hasta
+
+    def tiene(self, modelo: str) -> bool:
+        return self.modelos is None or modelo in self.modelos
+
+    def como_dict(self, ahora: float) -> dict:
+        return {
+            "url": self.url,
+            "sano": self.sano,
+            "expulsado_por_s": round(max(0.0, self.expulsado_hasta - ahora), 1),
+            "en_curso": self.en_curso,
+            "completadas": self.completadas,
+            "fallos": self.fallos,
+            "expulsiones": self.expulsiones,
+            "latencia_salud_ms": round(self.latencia_salud * 1000, 1) if self.latencia_salud is not None else None,
+            "modelos": sorted(self.modelos) if self.modelos is not None else None,
+        }
+
+
+class EnrutadorLLM:
+    """`fabrica_llm(url, modelo)` crea el chat model y `fabrica_cadena(llm)` la cadena
+    que se invoca (en rag_gratis: el stuff chain con el prompt). `cola()` es cuántas
+    consultas esperan turno del LLM; desde `umbral_respaldo` se usa `modelo_respaldo`."""
+
+    def __init__(
+        self,
+        urls: list[str],
+        modelo: str,
+        fabrica_llm: Callable[[str, str], BaseChatModel],
+        fabrica_cadena: Callable[[BaseChatModel], Runnable],
+        modelo_respaldo: str = "",
+        cola: Callable[[], int] = lambda: 0,
+        umbral_respaldo: int = 8,
+        keep_alive: str = "30m",
+        intervalo_salud: float = 10,
+        timeout_salud: float = 2,
+        lento_salud: float = 2,
+        fallos_expulsion: int = 3,
+        segundos_expulsion: float = 30,
+        timeout_precarga: float = 120,
+    ):
+        if not urls:
+            raise ValueError("EnrutadorLLM necesita al menos una URL de Ollama")
+        self.backends = [Backend(u) for u in urls]
+        self.modelo = modelo
+        self.modelo_respaldo = modelo_respaldo
+        self.fabrica_llm = fabrica_llm
+        self.fabrica_cadena = fabrica_cadena
+        self.cola = cola
+        self.umbral_respaldo = umbral_respaldo
+        self.keep_alive = keep_alive
+        self.intervalo_salud = intervalo_salud
+        self.timeout_salud = timeout_salud
+        self.lento_salud = lento_salud
+        self.fallos_expulsion = fallos_expulsion
+        self.segundos_expulsion = segundos_expulsion
+        self.timeout_precarga = timeout_precarga
+        self._lock = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+        self._detener = threading.Event()
+        self.respaldos = 0
+
+    # --- elección ---
+    def _modelo(self) -> str:
+        # el respaldo solo si algún backend disponible lo tiene; si no, el principal
+        if self.modelo_respaldo and self.cola() >= self.umbral_respaldo:
+            ahora = time.monotonic()
+            with self._lock:
+                hay = any(b.disponible(ahora) and b.tiene(self.modelo_respaldo) for b in self.backends)
+            if hay:
+                self.respaldos += 1
+                return self.modelo_respaldo
+        return self.modelo
+
+    def elegir(self, modelo: str, excluir: tuple = ()) -> Backend:
+        """El disponible con menos requests en curso; empates por latencia y al azar.
+        Si no queda ninguno disponible se prueba igual con el que vuelve antes."""
+        ahora = time.monotonic()
+        with self._lock:
+            candidatos = [b for b in self.backends if b not in excluir] or list(self.backends)
+            disponibles = [b for b in candidatos if b.disponible(ahora) and b.tiene(modelo)]
+            if not disponibles:
+                return min(candidatos, key=lambda b: (not b.sano, b.expulsado_hasta))
+            menos = min(b.en_curso for b in disponibles)
+            empatados = [b for b in disponibles if b.en_curso == menos]
+            return min(empatados, key=lambda b: (b.latencia_salud or 0.0, random.random()))
+
+    def _cadena(self, b: Backend, modelo: str) -> Runnable:
+        cadena = b._cadenas.get(modelo)
+        if cadena is None:
+            cadena = b._cadenas[modelo] = self.fabrica_cadena(self.fabrica_llm(b.url, modelo))
+        return cadena
+
+    @contextmanager
+    def _usar(self, b: Backend, modelo: str):
+        with self._lock:
+            b.en_curso += 1
+        try:
+            yield
+        except Exception as e:
+            if _sin_modelo(e):
+                self._registrar_sin_modelo(b, modelo)
+            else:
+                self._registrar_fallo(b)
+            raise
+        else:
+            with self._lock:
+                b.completadas += 1
+                b.fallos_seguidos = 0
+        finally:
+            with self._lock:
+                b.en_curso -= 1
+
+    def _registrar_fallo(self, b: Backend) -> None:
+        # las generaciones que ya estaban en curso cuando se expulsó al backend fallan
+        # por la misma caída: no suman a otra expulsión
+        with self._lock:
+            b.fallos += 1
+            ahora = time.monotonic()
+            if ahora < b.expulsado_hasta:
+                return
+            b.fallos_seguidos += 1
+            if b.fallos_seguidos < self.fallos_expulsion:
+                return
+            b.expulsado_hasta = ahora + self.segundos_expulsion
+            b.fallos_seguidos = 0
+            b.expulsiones += 1
+        print(f"[LLM] {b.url} expulsado {self.segundos_expulsion:.0f}s tras {self.fallos_expulsion} fallos seguidos.")
+
+    def _registrar_sin_modelo(self, b: Backend, modelo: str) -> None:
+        # hasta el próximo chequeo de salud no se le vuelve a pedir ese modelo
+        with self._lock:
+            if b.modelos is not None:
+                b.modelos.discard(modelo)
+        print(f"[LLM] {b.url} no tiene el modelo {modelo}.")
+
+    def _reintento(self, b: Backend, modelo: str, e: Exception, probados: tuple) -> tuple[str, tuple]:
+        """(modelo, probados) para el próximo intento o relanza `e`. Si faltaba el
+        modelo de respaldo se reintenta con el principal, también en el mismo backend;
+        si no, un reintento en otro backend."""
+        if modelo != self.modelo and _sin_modelo(e):
+            return self.modelo, probados
+        probados += (b,)
+        if len(probados) >= min(2, len(self.backends)):
+            raise e
+        print(f"[LLM] {b.url} falló ({e!r}), reintentando en otro backend.")
+        return modelo, probados
+
+    # --- generación: un reintento en otro backend si falla antes de responder ---
+    async def invocar(self, entrada: dict) -> Any:
+        modelo = self._modelo()
+        probados: tuple = ()
+        while True:
+            b = self.elegir(modelo, excluir=probados)
+            try:
+                with self._usar(b, modelo):
+                    return await self._cadena(b, modelo).ainvoke(entrada)
+            except Exception as e:
+                modelo, probados = self._reintento(b, modelo, e, probados)
+
+    async def stream(self, entrada: dict) -> AsyncIterator[Any]:
+        modelo = self._modelo()
+        probados: tuple = ()
+        while True:
+            b = self.elegir(modelo, excluir=probados)
+            emitido = False
+            try:
+                with self._usar(b, modelo):
+                    async for parte in self._cadena(b, modelo).astream(entrada):
+                        emitido = True
+                        yield parte
+                return
+            except Exception as e:
+                # con tokens ya enviados no se puede reintentar sin duplicar texto
+                if emitido:
+                    raise
+                modelo, probados = self._reintento(b, modelo, e, probados)
+
+    # --- salud y precarga (hilo en segundo plano) ---
+    def chequear(self, b: Backend, cliente: httpx.Client) -> None:
+        t0 = time.perf_counter()
+        try:
+            r = cliente.get(f"{b.url}/api/tags", timeout=self.timeout_salud)
+            r.raise_for_status()
+            modelos = {m.get("name") or m.get("model") for m in r.json().get("models", [])}
+            ok = True
+        except Exception as e:
+            modelos, ok = None, False
+            motivo = repr(e)
+        latencia = time.perf_counter() - t0
+        with self._lock:
+            b.latencia_salud = latencia if b.latencia_salud is None else 0.7 * b.latencia_salud + 0.3 * latencia
+            if modelos is not None:
+                b.modelos = modelos
+            lento = b.latencia_salud > self.lento_salud
+            antes, b.sano = b.sano, ok and not lento
+        if antes and not b.sano:
+            print(f"[LLM] {b.url} fuera de servicio: {motivo if not ok else f'lento ({latencia * 1000:.0f} ms)'}")
+        elif b.sano and not antes:
+            # pudo estar caído al iniciar: se precarga ahora
+            print(f"[LLM] {b.url} de vuelta en servicio.")
+            self.precalentar(b, cliente)
+
+    def precalentar(self, b: Backend, cliente: httpx.Client) -> None:
+        # /api/generate sin prompt solo carga el modelo y lo deja keep_alive en memoria
+        for modelo in filter(None, (self.modelo, self.modelo_respaldo)):
+            if not b.tiene(modelo):
+                print(f"[LLM] {b.url} no tiene el modelo {modelo}.")
+                continue
+            try:
+                cliente.post(
+                    f"{b.url}/api/generate",
+                    json={"model": modelo, "keep_alive": self.keep_alive},
+                    timeout=self.timeout_precarga,
+                ).raise_for_status()
+            except Exception as e:
+                print(f"[LLM] No se pudo precargar {modelo} en {b.url}: {e!r}")
+
+    def _bucle(self) -> None:
+        with httpx.Client() as cliente:
+            for b in self.backends:
+                self.chequear(b, cliente)
+                if b.sano:
+                    self.precalentar(b, cliente)
+            while not self._detener.wait(self.intervalo_salud):
+                for b in self.backends:
+                    self.chequear(b, cliente)
+
+    def iniciar(self) -> None:
+        if self.intervalo_salud > 0 and self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="salud-llm", daemon=True)
+            self._hilo.start()
+
+    def cerrar(self) -> None:
+        self._detener.set()
+
+    def estadisticas(self) -> dict:
+        ahora = time.monotonic()
+        with self._lock:
+            return {
+                "modelo": self.modelo,
+                "modelo_respaldo": self.modelo_respaldo or None,
+                "respaldos": self.respaldos,
+                "backends": [b.como_dict(ahora) for b in self.backends],
+            }
@@ -0,0 +1,378 @@
+# backend/indexador.py
+# Reindexado incremental: un manifiesto guarda, por PDF, el hash de su contenido,
+# los IDs de sus chunks y la configuración del splitter con que se generaron.
+from __future__ import annotations
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing, nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, ContextManager, Iterator, Optional
+
+import numpy as np
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from cache_embeddings import hash_texto
+from indices_ann import (
+    agregar as agregar_vectores, compactar, config_de, config_indice, marcar_borrados, min_entrenamiento,
+    nuevo_vectorstore, reentrenar, requiere_compactar, requiere_reentrenar, tipo_de,
+)
+from metricas import medir
+
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+
+# parseo de PDFs en procesos aparte y embeddings por lotes de tamaño fijo
+PARSEO_WORKERS = int(os.getenv("RAG_PARSEO_WORKERS", str(min(4, os.cpu_count() or 1))))
+LOTE_EMBEDDINGS = int(os.getenv("RAG_LOTE_EMBEDDINGS", "256"))
+
+
+def config_splitter() -> dict:
+    return {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+
+
+def crear_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(**config_splitter())
+
+
+def hash_archivo(ruta: Path) -> str:
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def cargar_splits(pdf: Path) -> list[Document]:
+    docs = PyPDFLoader(str(pdf)).load()
+    splits = crear_splitter().split_documents(docs)
+    for d in splits:
+        d.metadata["archivo"] = pdf.name  # dueño del chunk dentro del docstore
+    return splits
+
+
+def iterar_splits(pdfs: list[Path], workers: int = PARSEO_WORKERS) -> Iterator[tuple[Path, list[Document]]]:
+    """Parsea `pdfs` en un pool de procesos y entrega (pdf, splits) en orden.
+
+    Como mucho hay 2*workers PDFs parseados esperando a ser consumidos, así la
+    memoria no crece con el tamaño del corpus.
+    """
+    if workers <= 1 or len(pdfs) <= 1:
+        for pdf in pdfs:
+            yield pdf, cargar_splits(pdf)
+        return
+
+    # spawn: el proceso principal tiene hilos y el modelo de embeddings cargado
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(pdfs)), mp_context=ctx) as pool:
+        ventana = 2 * workers
+        en_curso = [(pdf, pool.submit(cargar_splits, pdf)) for pdf in pdfs[:ventana]]
+        siguientes = iter(pdfs[ventana:])
+        while en_curso:
+            pdf, futuro = en_curso.pop(0)
+            splits = futuro.result()
+            prox = next(siguientes, None)
+            if prox is not None:
+                en_curso.append((prox, pool.submit(cargar_splits, prox)))
+            yield pdf, splits
+
+
+class Manifiesto:
+    def __init__(
+        self,
+        ruta: Path,
+        splitter: Optional[dict] = None,
+        documentos: Optional[dict] = None,
+        indice: Optional[dict] = None,
+    ):
+        self.ruta = ruta
+        self.splitter = splitter or config_splitter()
+        self.indice = indice or {"tipo": "flat"}  # manifiestos anteriores: siempre flat
+        # nombre de archivo -> {"hash": str, "ids": [str], "chunks": int}
+        # Los IDs son el hash del texto del chunk: un chunk repetido (en el mismo PDF
+        # o en otro) está una sola vez en el índice y lo referencian varios PDFs.
+        self.documentos: dict[str, dict] = documentos or {}
+
+    def ids_en_uso(self) -> set[str]:
+        return {i for info in self.documentos.values() for i in info["ids"]}
+
+    @classmethod
+    def cargar(cls, ruta: Path) -> "Manifiesto":
+        try:
+            datos = json.loads(ruta.read_text(encoding="utf-8"))
+            return cls(ruta, datos.get("splitter"), datos.get("documentos"), datos.get("indice"))
+        except FileNotFoundError:
+            return cls(ruta, splitter={})
+        except Exception as e:
+            print(f"[manifiesto] No se pudo leer {ruta}, se reconstruirá: {e}")
+            return cls(ruta, splitter={})
+
+    def guardar(self) -> None:
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.ruta.with_suffix(".tmp")
+        tmp.write_text(
+            json.dumps(
+                {"splitter": self.splitter, "indice": self.indice, "documentos": self.documentos},
+                ensure_ascii=False, indent=1,
+            ),
+            encoding="utf-8",
+        )
+        os.replace(tmp, self.ruta)
+
+    def reiniciar(self) -> None:
+        self.splitter = config_splitter()
+        self.indice = config_indice()
+        self.documentos = {}
+
+
+@dataclass
+class ResultadoSincronizacion:
+    nuevos: list[str] = field(default_factory=list)
+    modificados: list[str] = field(default_factory=list)
+    eliminados: list[str] = field(default_factory=list)
+    sin_cambios: list[str] = field(default_factory=list)
+    reconstruido: bool = False
+    chunks_agregados: int = 0
+    chunks_duplicados: int = 0
+    chunks_eliminados: int = 0
+
+    @property
+    def hubo_cambios(self) -> bool:
+        return bool(self.nuevos or self.modificados or self.eliminados)
+
+
+def borrar_ids(vs: FAISS, ids: list[str]) -> int:
+    # FAISS.delete falla si algún ID no existe: se ignoran los que ya no están
+    existentes = set(vs.index_to_docstore_id.values())
+    ids = [i for i in ids if i in existentes]
+    if ids:
+        if tipo_de(vs.index) == "flat":
+            vs.delete(ids)
+        else:
+            marcar_borrados(vs, ids)
+    return len(ids)
+
+
+# claves de la metadata de un chunk que dicen de dónde sale (las que se citan)
+_CLAVES_REFERENCIA = ("archivo", "source", "page", "page_label")
+
+
+def _referencia(meta: dict) -> dict:
+    return {k: meta[k] for k in _CLAVES_REFERENCIA if k in meta}
+
+
+def actualizar_referencias(vs: FAISS, cambios: dict[str, list[dict]], quitados: set[str] = frozenset()) -> int:
+    """Un chunk compartido por varios PDFs guarda en `referencias` de dónde sale en
+    cada uno; su metadata principal es la del primero. `cambios` agrega referencias
+    por ID y `quitados` borra las de esos archivos: si se va el PDF principal, el
+    chunk pasa a citar al siguiente que lo contiene. Devuelve los chunks tocados."""
+    nuevos: dict[str, Document] = {}
+    for id_, agregar in cambios.items():
+        d = vs.docstore.search(id_)
+        if not isinstance(d, Document):
+            continue
+        refs = [r for r in d.metadata.get("referencias") or [_referencia(d.metadata)] if r.get("archivo") not in quitados]
+        for r in agregar:
+            refs = [x for x in refs if x.get("archivo") != r.get("archivo")] + [r]
+        if not refs:
+            continue
+        meta = {**d.metadata, **refs[0], "referencias": refs}
+        if meta != d.metadata:
+            nuevos[id_] = Document(id=id_, page_content=d.page_content, metadata=meta)
+    if nuevos:
+        # delete + add: InMemoryDocstore no acepta add de un ID que ya existe
+        vs.docstore.delete(list(nuevos))
+        vs.docstore.add(nuevos)
+    return len(nuevos)
+
+
+def mantener_indice(vs: Optional[FAISS], embeddings: Optional[Embeddings], manifiesto: Manifiesto) -> Optional[FAISS]:
+    """Reentrena si el índice ya no corresponde a la configuración o al tamaño del
+    corpus (IVF-PQ entrenado con pocos vectores), o compacta si sobran lápidas.
+    Fuera de `escritura`: la copia nueva reemplaza a `vs` cuando se publica. El
+    manifiesto anota lo que de verdad quedó construido."""
+    if embeddings is not None and requiere_reentrenar(vs):
+        with medir("ingesta_compactacion"):
+            vs = reentrenar(vs, embeddings)
+    elif embeddings is not None and requiere_compactar(vs):
+        with medir("ingesta_compactacion"):
+            vs = compactar(vs, embeddings)
+    if vs is not None:
+        manifiesto.indice = config_de(vs.index)
+    return vs
+
+
+# `escritura` envuelve cada modificación en el lugar de un índice que ya se está
+# consultando (p.ej. el lado escritor de un LockLecturaEscritura)
+Escritura = Callable[[], ContextManager]
+
+
+def quitar_documento(
+    vs: Optional[FAISS], nombre: str, manifiesto: Manifiesto, escritura: Escritura = nullcontext,
+    embeddings: Optional[Embeddings] = None,
+) -> tuple[Optional[FAISS], int]:
+    """Borra del índice y del manifiesto los chunks de un PDF que ningún otro PDF
+    comparte. Cuesta O(chunks del PDF) más recorrer los IDs del manifiesto; con
+    `embeddings` puede devolver un índice compactado o reentrenado (mantener_indice)."""
+    info = manifiesto.documentos.pop(nombre, None)
+    if info is None or vs is None:
+        return vs, 0
+    en_uso = manifiesto.ids_en_uso()
+    with escritura():
+        n = borrar_ids(vs, [i for i in info["ids"] if i not in en_uso])
+        actualizar_referencias(vs, {i: [] for i in info["ids"] if i in en_uso}, {nombre})
+    if not manifiesto.documentos:
+        return None, n
+    return mantener_indice(vs, embeddings, manifiesto), n
+
+
+def requiere_reconstruccion(vs: Optional[FAISS], manifiesto: Manifiesto) -> bool:
+    # sin índice, con otro splitter o sin manifiesto (origen desconocido) no se puede
+    # actualizar por partes. Otro tipo de índice no obliga a reparsear: mantener_indice
+    # lo reentrena con los vectores que ya hay
+    return (
+        vs is None
+        or manifiesto.splitter != config_splitter()
+        or not manifiesto.documentos
+    )
+
+
+def sincronizar(
+    vs: Optional[FAISS],
+    pdfs: list[Path],
+    manifiesto: Manifiesto,
+    embeddings: Embeddings,
+    eliminar_ausentes: bool = True,
+    escritura: Escritura = nullcontext,
+    avance: Optional[Callable[[float, str], None]] = None,
+) -> tuple[Optional[FAISS], ResultadoSincronizacion]:
+    """Lleva `vs` al estado de `pdfs`: embebe solo PDFs nuevos o modificados y borra
+    los vectores de los que ya no están. Modifica `vs` y `manifiesto` en el lugar.
+    Los PDFs se parsean en paralelo (`iterar_splits`) y se embeben por lotes.
+
+    Si `requiere_reconstruccion`, se reconstruye todo desde cero con `pdfs` en un
+    índice nuevo, sin tocar `vs`. Parseo y embeddings ocurren fuera de `escritura`.
+    """
+    res = ResultadoSincronizacion()
+    if requiere_reconstruccion(vs, manifiesto):
+        vs = None
+        manifiesto.reiniciar()
+        res.reconstruido = True
+    if vs is None:
+        escritura = nullcontext  # índice propio, nadie más lo está leyendo
+
+    hashes = {pdf.name: hash_archivo(pdf) for pdf in pdfs}
+    rutas = {pdf.name: pdf for pdf in pdfs}
+
+    por_borrar: list[str] = []
+    for nombre, info in list(manifiesto.documentos.items()):
+        if nombre not in hashes:
+            if eliminar_ausentes:
+                res.eliminados.append(nombre)
+                por_borrar.extend(info["ids"])
+                del manifiesto.documentos[nombre]
+        elif hashes[nombre] != info["hash"]:
+            res.modificados.append(nombre)
+            por_borrar.extend(info["ids"])
+            del manifiesto.documentos[nombre]
+        else:
+            res.sin_cambios.append(nombre)
+    res.nuevos = [n for n in hashes if n not in res.modificados and n not in res.sin_cambios]
+
+    if por_borrar and vs is not None:
+        en_uso = manifiesto.ids_en_uso()
+        quitados = set(res.eliminados + res.modificados)
+        with escritura(), medir("ingesta_indexado"):
+            res.chunks_eliminados = borrar_ids(vs, [i for i in por_borrar if i not in en_uso])
+            actualizar_referencias(vs, {i: [] for i in por_borrar if i in en_uso}, quitados)
+
+    # los chunks se acumulan en lotes de LOTE_EMBEDDINGS: se embeben y se agregan
+    # al índice lote a lote; un PDF entra al manifiesto cuando todos sus chunks
+    # ya están en el índice. Un índice nuevo que requiere entrenamiento (IVF-PQ)
+    # retiene los vectores hasta juntar min_entrenamiento().
+    # Los chunks cuyo ID (hash del texto) ya está en el índice o en un lote de esta
+    # pasada no se vuelven a agregar; el chunk conserva la metadata del primer PDF
+    # y suma una referencia al otro (se aplican al final, ver actualizar_referencias).
+    indexados = set(vs.index_to_docstore_id.values()) if vs is not None else set()
+    referencias: dict[str, list[dict]] = {}
+    lote: list[tuple[str, Document]] = []
+    faltantes: dict[str, int] = {}
+    entradas: dict[str, dict] = {}
+    espera: tuple[list, list, list] = ([], [], [])  # pares, metadatas, ids
+
+    def agregar(pares: list, metadatas: list, ids: list, final: bool = False) -> None:
+        nonlocal vs
+        if vs is None:
+            espera[0].extend(pares)
+            espera[1].extend(metadatas)
+            espera[2].extend(ids)
+            if not espera[2] or (len(espera[2]) < min_entrenamiento() and not final):
+                return
+            pares, metadatas, ids = (list(x) for x in espera)
+            for x in espera:
+                x.clear()
+            with medir("ingesta_indexado"):
+                vs = nuevo_vectorstore(embeddings, np.asarray([v for _, v in pares], dtype="float32"))
+                agregar_vectores(vs, pares, metadatas, ids)
+        elif pares:
+            with escritura(), medir("ingesta_indexado"):
+                agregar_vectores(vs, pares, metadatas, ids)
+        for meta in metadatas:
+            nombre = meta["archivo"]
+            faltantes[nombre] -= 1
+            if not faltantes[nombre]:
+                manifiesto.documentos[nombre] = entradas.pop(nombre)
+
+    def volcar(final: bool = False) -> None:
+        textos = [d.page_content for _, d in lote]
+        with medir("ingesta_embedding"):
+            pares = list(zip(textos, embeddings.embed_documents(textos))) if textos else []
+        agregar(pares, [d.metadata for _, d in lote], [i for i, _ in lote], final=final)
+        lote.clear()
+
+    por_indexar = [rutas[n] for n in sorted(res.nuevos + res.modificados)]
+    # el tiempo de "ingesta_parseo" es lo que se espera al pool de parseo
+    with closing(iterar_splits(por_indexar)) as splits_por_pdf:
+        for i in range(len(por_indexar)):
+            with medir("ingesta_parseo"):
+                pdf, splits = next(splits_por_pdf)
+            if avance:
+                avance(i / len(por_indexar), f"Indexando {pdf.name} ({i + 1}/{len(por_indexar)})")
+            ids = [hash_texto(d.page_content) for d in splits]
+            unicos = list(dict.fromkeys(ids))
+            entrada = {"hash": hashes[pdf.name], "ids": unicos, "chunks": len(unicos)}
+            nuevos = []
+            vistos: set[str] = set()
+            for id_, d in zip(ids, splits):
+                if id_ not in indexados:
+                    indexados.add(id_)
+                    nuevos.append((id_, d))
+                elif id_ not in vistos:
+                    referencias.setdefault(id_, []).append(_referencia(d.metadata))
+                vistos.add(id_)
+            res.chunks_agregados += len(nuevos)
+            res.chunks_duplicados += len(splits) - len(nuevos)
+            if not nuevos:
+                manifiesto.documentos[pdf.name] = entrada
+                continue
+            entradas[pdf.name] = entrada
+            faltantes[pdf.name] = len(nuevos)
+            for par in nuevos:
+                lote.append(par)
+                if len(lote) >= LOTE_EMBEDDINGS:
+                    volcar()
+    volcar(final=True)
+    if referencias and vs is not None:
+        with escritura(), medir("ingesta_indexado"):
+            actualizar_referencias(vs, referencias)
+
+    if not manifiesto.documentos:
+        return None, res
+    return mantener_indice(vs, embeddings, manifiesto), res
@@ -0,0 +1,339 @@
+# backend/indices_ann.py
+# Tipo de índice FAISS configurable: flat (exacto), HNSW o IVF+PQ.
+from __future__ import annotations
+import os
+import time
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Optional
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+TIPOS = ("flat", "hnsw", "ivfpq")
+
+INDEX_TIPO = os.getenv("RAG_INDEX_TIPO", "flat").lower()
+HNSW_M = int(os.getenv("RAG_HNSW_M", "32"))
+HNSW_EF_CONSTRUCCION = int(os.getenv("RAG_HNSW_EF_CONSTRUCCION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "64"))
+IVF_NLIST = int(os.getenv("RAG_IVF_NLIST", "1024"))
+IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("RAG_PQ_M", "48"))        # subvectores; debe dividir la dimensión (384 en MiniLM)
+PQ_BITS = int(os.getenv("RAG_PQ_BITS", "8"))
+# HNSW/IVF: fracción de vectores borrados (lápidas) desde la que se compacta el índice
+COMPACTAR_BORRADOS = float(os.getenv("RAG_COMPACTAR_BORRADOS", "0.2"))
+MAX_CONSULTAS_REPORTE = int(os.getenv("RAG_REPORTE_MAX_CONSULTAS", "1000"))
+
+if INDEX_TIPO not in TIPOS:
+    raise ValueError(f"RAG_INDEX_TIPO debe ser uno de {TIPOS}, no '{INDEX_TIPO}'")
+
+
+def config_indice() -> dict:
+    # solo lo que cambia la construcción: si difiere del manifiesto hay que reconstruir
+    if INDEX_TIPO == "hnsw":
+        return {"tipo": "hnsw", "m": HNSW_M, "ef_construccion": HNSW_EF_CONSTRUCCION}
+    if INDEX_TIPO == "ivfpq":
+        return {"tipo": "ivfpq", "nlist": IVF_NLIST, "pq_m": PQ_M, "pq_bits": PQ_BITS}
+    return {"tipo": "flat"}
+
+
+def config_para(n: int, dim: int) -> dict:
+    """Lo que `crear_indice` construye con `n` vectores: con pocos, IVF-PQ usa menos
+    listas (~39 vectores por centroide) o queda en flat."""
+    config = config_indice()
+    if config["tipo"] == "ivfpq":
+        if n < 2 ** PQ_BITS or dim % PQ_M:
+            return {"tipo": "flat"}
+        config["nlist"] = max(1, min(IVF_NLIST, n // 39))
+    return config
+
+
+def config_de(index: faiss.Index) -> dict:
+    """La configuración con que se construyó `index` (se lee del índice mismo)."""
+    if isinstance(index, faiss.IndexHNSW):
+        return {"tipo": "hnsw", "m": index.hnsw.nb_neighbors(1), "ef_construccion": index.hnsw.efConstruction}
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        pq = faiss.downcast_index(ivf).pq
+        return {"tipo": "ivfpq", "nlist": ivf.nlist, "pq_m": pq.M, "pq_bits": pq.nbits}
+    return {"tipo": "flat"}
+
+
+def config_vigente(construida: dict, n: int, dim: int) -> bool:
+    """Si un índice construido con `construida` sirve para `n` vectores. Un IVF-PQ
+    entrenado con un corpus chico (menos listas, o flat) deja de servir cuando el
+    corpus da para el doble de listas: ahí hay que reentrenarlo. Si el corpus se
+    achica, el IVF-PQ se mantiene."""
+    ideal = config_para(n, dim)
+    if construida == ideal:
+        return True
+    objetivo = config_indice()
+    if objetivo["tipo"] == "ivfpq" and construida.get("tipo") == "ivfpq":
+        return {**construida, "nlist": objetivo["nlist"]} == objetivo and (
+            ideal["tipo"] == "flat" or ideal["nlist"] < 2 * construida["nlist"]
+        )
+    return False
+
+
+def necesita_entrenamiento() -> bool:
+    return INDEX_TIPO == "ivfpq"
+
+
+def min_entrenamiento() -> int:
+    # ~39 puntos por centroide es lo mínimo que FAISS acepta sin advertencias
+    return max(IVF_NLIST, 2 ** PQ_BITS) * 39 if necesita_entrenamiento() else 0
+
+
+def tipo_de(index: faiss.Index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if faiss.try_extract_index_ivf(index) is not None:
+        return "ivfpq"
+    return "flat"
+
+
+def crear_indice(muestra: np.ndarray) -> faiss.Index:
+    """Índice vacío del tipo configurado; los IVF se entrenan con `muestra`."""
+    n, dim = muestra.shape
+    config = config_para(n, dim)
+    if config["tipo"] == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCCION
+    elif config["tipo"] == "ivfpq":
+        cuantizador = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(cuantizador, dim, config["nlist"], PQ_M, PQ_BITS)
+        index.train(muestra)
+    else:
+        if INDEX_TIPO == "ivfpq":
+            print(f"[FAISS] IVF-PQ no aplicable ({n} vectores, dim {dim}, pq_m {PQ_M}); se usa índice flat.")
+        index = faiss.IndexFlatL2(dim)
+    ajustar_busqueda(index)
+    return index
+
+
+def ajustar_busqueda(index: faiss.Index) -> None:
+    # nprobe/efSearch se leen de la configuración también al cargar un índice guardado
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(IVF_NPROBE, ivf.nlist)
+
+
+def nuevo_vectorstore(embeddings: Embeddings, muestra: np.ndarray) -> FAISS:
+    return FAISS(
+        embedding_function=embeddings,
+        index=crear_indice(muestra),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+
+
+def memoria_estimada(index: faiss.Index) -> int:
+    # estimación en bytes sin serializar el índice
+    n, d = index.ntotal, index.d
+    if isinstance(index, faiss.IndexHNSW):
+        return n * d * 4 + n * index.hnsw.nb_neighbors(0) * 4
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return n * (ivf.code_size + 8) + ivf.nlist * d * 4
+    return n * d * 4
+
+
+def similitud(index: faiss.Index, distancias: np.ndarray) -> np.ndarray:
+    # mayor es mejor en ambas métricas: las distancias L2 se niegan
+    return distancias if index.metric_type == faiss.METRIC_INNER_PRODUCT else -distancias
+
+
+def describir(index: Optional[faiss.Index]) -> dict:
+    if index is None:
+        return {"tipo": INDEX_TIPO, "vectores": 0, "memoria_bytes": 0}
+    info = {"tipo": tipo_de(index), "vectores": index.ntotal, "dimension": index.d,
+            "memoria_bytes": memoria_estimada(index)}
+    if isinstance(index, faiss.IndexHNSW):
+        info["ef_search"] = index.hnsw.efSearch
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        info.update(nlist=ivf.nlist, nprobe=ivf.nprobe)
+    return info
+
+
+def vectores_exactos(index: faiss.Index) -> Optional[np.ndarray]:
+    # flat y HNSW guardan los vectores originales; PQ solo una aproximación
+    if tipo_de(index) == "ivfpq" or not index.ntotal:
+        return None
+    return index.reconstruct_n(0, index.ntotal)
+
+
+# --- posiciones estables: HNSW/IVF no se reconstruyen al borrar ---
+# `index_to_docstore_id` va de la posición en FAISS al ID del chunk. En HNSW/IVF un
+# borrado solo quita sus posiciones del dict (lápidas): el vector sigue en el índice
+# y las búsquedas lo saltan. `compactar` rehace el índice sin lápidas en una copia.
+
+def agregar(vs: FAISS, pares: list[tuple[str, list[float]]], metadatas: list[dict], ids: list[str]) -> None:
+    """Como FAISS.add_embeddings, pero las posiciones nuevas parten en `ntotal` y no en
+    len(index_to_docstore_id), que con lápidas es menor."""
+    if not pares:
+        return
+    inicio = vs.index.ntotal
+    vs.index.add(np.asarray([v for _, v in pares], dtype="float32"))
+    vs.docstore.add({
+        id_: Document(id=id_, page_content=texto, metadata=meta)
+        for id_, (texto, _), meta in zip(ids, pares, metadatas)
+    })
+    vs.index_to_docstore_id.update({inicio + j: id_ for j, id_ in enumerate(ids)})
+
+
+def borrados(vs: FAISS) -> int:
+    return vs.index.ntotal - len(vs.index_to_docstore_id)
+
+
+def marcar_borrados(vs: FAISS, ids: list[str]) -> None:
+    """Borrado para HNSW/IVF: HNSW no implementa remove_ids y en IVF no compacta las
+    posiciones. El dict se reemplaza (no se edita) para que almacen reescriba las
+    posiciones guardadas."""
+    borrar = set(ids)
+    vs.index_to_docstore_id = {p: i for p, i in vs.index_to_docstore_id.items() if i not in borrar}
+    vs.docstore.delete(list(borrar))
+
+
+def requiere_compactar(vs: Optional[FAISS]) -> bool:
+    return vs is not None and vs.index.ntotal > 0 and borrados(vs) > COMPACTAR_BORRADOS * vs.index.ntotal
+
+
+def _vectores_vivos(vs: FAISS, vivas: list[int], embeddings: Embeddings) -> np.ndarray:
+    # los vectores de PQ se vuelven a embeber (cache de embeddings) para no
+    # recodificar aproximaciones; flat y HNSW guardan los originales
+    if tipo_de(vs.index) == "ivfpq":
+        textos = [vs.docstore.search(vs.index_to_docstore_id[p]).page_content for p in vivas]
+        return np.asarray(embeddings.embed_documents(textos), dtype="float32")
+    return np.vstack([vs.index.reconstruct(p) for p in vivas])
+
+
+def compactar(vs: FAISS, embeddings: Embeddings) -> FAISS:
+    """Índice nuevo con solo los vectores vivos, sin tocar `vs`: se arma fuera del
+    lock y se publica después. Reutiliza el entrenamiento de IVF."""
+    vivas = sorted(vs.index_to_docstore_id)
+    index = faiss.clone_index(vs.index)
+    index.reset()
+    ajustar_busqueda(index)
+    if vivas:
+        index.add(_vectores_vivos(vs, vivas, embeddings))
+    mapping = {nueva: vs.index_to_docstore_id[vieja] for nueva, vieja in enumerate(vivas)}
+    print(f"[FAISS] Índice compactado: {vs.index.ntotal - len(vivas)} lápidas quitadas.")
+    return FAISS(embeddings, index, vs.docstore, mapping)
+
+
+def requiere_reentrenar(vs: Optional[FAISS]) -> bool:
+    return (
+        vs is not None
+        and bool(vs.index_to_docstore_id)
+        and not config_vigente(config_de(vs.index), len(vs.index_to_docstore_id), vs.index.d)
+    )
+
+
+def reentrenar(vs: FAISS, embeddings: Embeddings) -> FAISS:
+    """Como `compactar`, pero con un índice nuevo entrenado con todos los vectores
+    vivos (p.ej. IVF-PQ con más listas cuando el corpus creció)."""
+    vivas = sorted(vs.index_to_docstore_id)
+    vectores = np.ascontiguousarray(_vectores_vivos(vs, vivas, embeddings), dtype="float32")
+    antes = config_de(vs.index)
+    index = crear_indice(vectores)
+    index.add(vectores)
+    mapping = {nueva: vs.index_to_docstore_id[vieja] for nueva, vieja in enumerate(vivas)}
+    print(f"[FAISS] Índice reentrenado con {len(vivas)} vectores: {antes} -> {config_de(index)}.")
+    return FAISS(embeddings, index, vs.docstore, mapping)
+
+
+def _medir(
+    index: faiss.Index, consultas: np.ndarray, k: int, params=None, lectura: Callable[[], ContextManager] = nullcontext
+) -> tuple[np.ndarray, list[float]]:
+    tiempos, resultados = [], []
+    with lectura():
+        for q in consultas:
+            t = time.perf_counter()
+            _, I = index.search(q[None, :], k, params=params)
+            tiempos.append((time.perf_counter() - t) * 1000)
+            resultados.append(I[0])
+    return np.vstack(resultados), tiempos
+
+
+def _percentil(valores: list[float], p: float) -> float:
+    return round(float(np.percentile(valores, p)), 4) if valores else 0.0
+
+
+def reporte_recall(
+    vs: FAISS,
+    embeddings: Embeddings,
+    n_consultas: int = 100,
+    k: int = 10,
+    lectura: Callable[[], ContextManager] = nullcontext,
+) -> dict:
+    """Recall@k y latencia del índice activo contra un índice flat exacto, barriendo
+    nprobe (IVF) o efSearch (HNSW). Las consultas son chunks del propio corpus.
+
+    No modifica el índice compartido: nprobe/efSearch van en los parámetros de cada
+    búsqueda. `lectura` (el lado lector del lock de la colección) se toma solo para
+    copiar lo necesario y durante cada paso del barrido, no en todo el reporte."""
+    n_consultas = max(1, min(n_consultas, MAX_CONSULTAS_REPORTE))
+    k = max(1, min(k, 100))
+    with lectura():
+        index = vs.index
+        tipo = tipo_de(index)
+        mapa = dict(vs.index_to_docstore_id)
+        base = vectores_exactos(index) if mapa else None
+        extra = min(borrados(vs), k)
+    if not mapa:
+        return {"tipo": tipo, "vectores": 0, "mediciones": []}
+
+    # la verdad exacta es solo sobre las posiciones vivas (sin lápidas)
+    vivas = np.fromiter(sorted(mapa), dtype="int64")
+    if base is None:
+        # PQ: se reembeben los textos (cache de embeddings) fuera del lock
+        docs = [vs.docstore.search(mapa[int(p)]) for p in vivas]
+        presentes = [j for j, d in enumerate(docs) if isinstance(d, Document)]  # borrados entretanto
+        vivas = vivas[presentes]
+        base = np.asarray(embeddings.embed_documents([docs[j].page_content for j in presentes]), dtype="float32")
+    else:
+        base = base[vivas]
+    base = np.ascontiguousarray(base, dtype="float32")
+
+    rng = np.random.default_rng(0)
+    muestra = rng.choice(len(vivas), size=min(n_consultas, len(vivas)), replace=False)
+    consultas = base[muestra]
+    k = min(k, len(vivas))
+
+    exacto = faiss.IndexIDMap(faiss.IndexFlatL2(base.shape[1]))
+    exacto.add_with_ids(base, vivas)
+    verdad, t_exacto = _medir(exacto, consultas, k)
+
+    def medicion(param: Optional[str], valor: Optional[int], params=None) -> dict:
+        # como en las consultas: se piden unas de más y se saltan las lápidas
+        I, tiempos = _medir(index, consultas, k + extra, params=params, lectura=lectura)
+        aciertos = sum(len(set([int(p) for p in a if int(p) in mapa][:k]) & set(b)) for a, b in zip(I, verdad))
+        return {"parametro": param, "valor": valor, "recall": round(aciertos / verdad.size, 4),
+                "latencia_ms_p50": _percentil(tiempos, 50), "latencia_ms_p99": _percentil(tiempos, 99)}
+
+    mediciones = []
+    ivf = faiss.try_extract_index_ivf(index)
+    if isinstance(index, faiss.IndexHNSW):
+        for ef in sorted({max(ef, k + extra) for ef in (16, 32, 64, 128, 256, index.hnsw.efSearch)}):
+            mediciones.append(medicion("ef_search", ef, faiss.SearchParametersHNSW(efSearch=ef)))
+    elif ivf is not None:
+        for nprobe in sorted({1, 2, 4, 8, 16, 32, 64, 128, ivf.nprobe}):
+            if nprobe <= ivf.nlist:
+                mediciones.append(medicion("nprobe", nprobe, faiss.SearchParametersIVF(nprobe=nprobe)))
+    else:
+        mediciones.append(medicion(None, None))
+
+    return {
+        "tipo": tipo,
+        "vectores": len(vivas),
+        "consultas": len(consultas),
+        "k": k,
+        "exacto": {"latencia_ms_p50": _percentil(t_exacto, 50), "latencia_ms_p99": _percentil(t_exacto, 99)},
+        "mediciones": mediciones,
+    }
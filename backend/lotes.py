@@ -0,0 +1,113 @@
+# backend/lotes.py
+# Micro-lotes para el camino de consulta: las preguntas que llegan dentro de una
+# ventana de pocos ms se procesan juntas (un solo embed y un solo FAISS search), y
+# las preguntas idénticas en curso comparten una sola generación del LLM.
+from __future__ import annotations
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from metricas import tiempos_request
+
+
+class AgrupadorLotes:
+    """Junta llamadas a `pedir(arg)` y ejecuta `fn_lote(args)` una vez por lote en
+    un hilo. `fn_lote` recibe argumentos únicos y devuelve un resultado por cada uno.
+
+    El lote sale cuando pasan `ventana_ms` desde la primera llamada o cuando junta
+    `max_lote` argumentos, lo que ocurra antes. Los tiempos de etapa medidos en
+    `fn_lote` se suman al desglose (Server-Timing) de cada request del lote.
+    """
+
+    def __init__(self, fn_lote: Callable[[list], list], ventana_ms: float = 5, max_lote: int = 32):
+        self.fn_lote = fn_lote
+        self.ventana = ventana_ms / 1000
+        self.max_lote = max(1, max_lote)
+        self._pendientes: list[tuple[Any, asyncio.Future, Optional[dict]]] = []
+        self._temporizador: Optional[asyncio.TimerHandle] = None
+        self.lotes = 0
+        self.llamadas = 0
+
+    async def pedir(self, arg: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self._pendientes.append((arg, futuro, tiempos_request.get()))
+        if len(self._pendientes) >= self.max_lote or self.ventana <= 0:
+            self._despachar()
+        elif self._temporizador is None:
+            self._temporizador = loop.call_later(self.ventana, self._despachar)
+        return await futuro
+
+    def _despachar(self) -> None:
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        lote, self._pendientes = self._pendientes, []
+        if lote:
+            asyncio.get_running_loop().create_task(self._correr(lote))
+
+    async def _correr(self, lote: list[tuple[Any, asyncio.Future, Optional[dict]]]) -> None:
+        unicos = list(dict.fromkeys(arg for arg, _, _ in lote))
+        self.lotes += 1
+        self.llamadas += len(lote)
+        # la tarea hereda el contexto de quien despachó: sin esto sus tiempos irían
+        # solo al desglose de ese request
+        tiempos: dict = {}
+        tiempos_request.set(tiempos)
+        try:
+            resultados = dict(zip(unicos, await asyncio.to_thread(self.fn_lote, unicos)))
+        except Exception as e:
+            for _, futuro, _ in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+        finally:
+            for destino in {id(t): t for _, _, t in lote if t is not None}.values():
+                for etapa, segundos in tiempos.items():
+                    destino[etapa] = destino.get(etapa, 0.0) + segundos
+        for arg, futuro, _ in lote:
+            if not futuro.done():  # quien esperaba pudo cancelarse (cliente desconectado)
+                futuro.set_result(resultados[arg])
+
+    def estadisticas(self) -> dict:
+        return {
+            "lotes": self.lotes,
+            "consultas": self.llamadas,
+            "tamano_medio": round(self.llamadas / self.lotes, 2) if self.lotes else 0.0,
+        }
+
+
+class Coalescedor:
+    """Llamadas con la misma clave mientras la primera sigue en curso esperan su
+    resultado en vez de repetir el trabajo. La tarea compartida no se cancela si
+    se desconecta quien la inició. Sus tiempos de etapa se suman al desglose de
+    cada request que la esperó."""
+
+    def __init__(self):
+        self._en_curso: dict[Hashable, asyncio.Task] = {}
+        self.compartidas = 0
+
+    async def ejecutar(self, clave: Hashable, fabrica: Callable[[], Awaitable[Any]]) -> Any:
+        tarea = self._en_curso.get(clave)
+        if tarea is None:
+            tarea = asyncio.ensure_future(self._medida(fabrica))
+            self._en_curso[clave] = tarea
+            tarea.add_done_callback(lambda _: self._en_curso.pop(clave, None))
+        else:
+            self.compartidas += 1
+        resultado, tiempos = await asyncio.shield(tarea)
+        destino = tiempos_request.get()
+        if destino is not None:
+            for etapa, segundos in tiempos.items():
+                destino[etapa] = destino.get(etapa, 0.0) + segundos
+        return resultado
+
+    @staticmethod
+    async def _medida(fabrica: Callable[[], Awaitable[Any]]) -> tuple[Any, dict]:
+        # la tarea hereda el contexto de quien la creó: con su propio dict, sus
+        # tiempos no van solo al desglose de ese request
+        tiempos: dict = {}
+        tiempos_request.set(tiempos)
+        return await fabrica(), tiempos
+
+    def estadisticas(self) -> dict:
+        return {"en_curso": len(self._en_curso), "compartidas": self.compartidas}
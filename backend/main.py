@@ -1,10 +1,32 @@
-from fastapi import FastAPI
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+import metricas
+from database import cerrar_engines, crear_tablas, estado_pools, estado_tablas
 from routers.auth import router as auth_router  # Router para autenticación y usuarios
+from routers.auth import pool_contrasenas
 from rag_gratis import router as rag_router     # Router para funcionalidades de RAG
+from rag_gratis import cerrar, esta_listo, estado_inicio, iniciar_en_segundo_plano
 from routers.history import router as history_router
 
-app = FastAPI(title="RAG-Gratis API", version="1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # nada pesado aquí: el servidor acepta conexiones de inmediato y las tablas,
+    # el modelo de embeddings y el índice se cargan en segundo plano (/health/ready)
+    threading.Thread(target=crear_tablas, name="crear-tablas", daemon=True).start()
+    iniciar_en_segundo_plano()
+    pool_contrasenas.iniciar()
+    yield
+    cerrar()  # vacía el historial pendiente antes de cerrar los pools
+    pool_contrasenas.cerrar()
+    await cerrar_engines()
+
+app = FastAPI(title="RAG-Gratis API", version="1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -12,8 +34,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Siguiente-Cursor", "Server-Timing"],
 )
 
+# desglose por etapa de cada request en la cabecera Server-Timing (RAG_SERVER_TIMING=1)
+SERVER_TIMING = os.getenv("RAG_SERVER_TIMING", "0") == "1"
+
+@app.middleware("http")
+async def medir_request(request: Request, call_next):
+    tiempos: dict = {}
+    token = metricas.tiempos_request.set(tiempos)
+    t0 = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        metricas.tiempos_request.reset(token)
+    total = time.perf_counter() - t0
+    ruta = request.scope.get("route")
+    metricas.http.observar(
+        total, metodo=request.method, ruta=getattr(ruta, "path", "otra"), codigo=response.status_code
+    )
+    if SERVER_TIMING:
+        # en /preguntar/stream solo alcanza a incluir lo previo al primer byte
+        response.headers["Server-Timing"] = metricas.server_timing({**tiempos, "total": total})
+    return response
+
 app.include_router(auth_router)
 app.include_router(rag_router)
 app.include_router(history_router)
@@ -21,3 +66,17 @@ app.include_router(history_router)
 @app.get("/")
 def home():
     return {"message": "🚀 API de RAG en ejecución"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(metricas.exponer(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/live")
+def liveness():
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+def readiness():
+    listo = esta_listo() and estado_tablas["creadas"]
+    cuerpo = {"listo": listo, "rag": estado_inicio(), "db": {**estado_tablas, "pools": estado_pools()}}
+    return JSONResponse(cuerpo, status_code=200 if listo else 503)
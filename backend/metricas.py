@@ -0,0 +1,126 @@
+# backend/metricas.py
+# Métricas en formato de texto de Prometheus (sin dependencias): histogramas de
+# latencia por etapa, contadores y valores que se leen al momento de exponer.
+# Cada request lleva además su propio desglose de tiempos (cabecera Server-Timing).
+from __future__ import annotations
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_metricas: list = []
+# etapa -> segundos acumulados en el request actual; None fuera de un request
+tiempos_request: ContextVar[Optional[dict]] = ContextVar("tiempos_request", default=None)
+
+
+def _etiquetas(nombres: tuple, valores: tuple, extra: str = "") -> str:
+    partes = [f'{n}="{str(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, etiquetas
+        self._valores: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _metricas.append(self)
+
+    def inc(self, valor: float = 1, **etiquetas) -> None:
+        clave = tuple(etiquetas.get(e, "") for e in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def exponer(self) -> list[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            for clave, v in sorted(self._valores.items()):
+                lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {v}")
+        return lineas
+
+
+class Histograma:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = BUCKETS_SEGUNDOS):
+        self.nombre, self.ayuda, self.etiquetas, self.buckets = nombre, ayuda, etiquetas, buckets
+        # etiquetas -> [conteos por bucket..., suma, total]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _metricas.append(self)
+
+    def observar(self, valor: float, **etiquetas) -> None:
+        clave = tuple(etiquetas.get(e, "") for e in self.etiquetas)
+        with self._lock:
+            serie = self._series.setdefault(clave, [0] * len(self.buckets) + [0.0, 0])
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exponer(self) -> list[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            for clave, serie in sorted(self._series.items()):
+                for limite, n in zip((*self.buckets, "+Inf"), (*serie[:-2], serie[-1])):
+                    le = 'le="%s"' % limite
+                    lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, le)} {n}")
+                lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {round(serie[-2], 6)}")
+                lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {serie[-1]}")
+        return lineas
+
+
+class Medidor:
+    """Valores que ya existen en otro lado (tamaño del índice, stats de caches):
+    `fn` devuelve {etiquetas: valor} y se llama al exponer."""
+
+    def __init__(self, nombre: str, ayuda: str, fn: Callable[[], dict], etiquetas: tuple = (), tipo: str = "gauge"):
+        self.nombre, self.ayuda, self.fn, self.etiquetas, self.tipo = nombre, ayuda, fn, etiquetas, tipo
+        _metricas.append(self)
+
+    def exponer(self) -> list[str]:
+        try:
+            valores = self.fn()
+        except Exception as e:
+            print(f"[metricas] {self.nombre}: {e!r}")
+            return []
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        for clave, v in valores.items():
+            clave = clave if isinstance(clave, tuple) else (clave,)
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {float(v)}")
+        return lineas
+
+
+def exponer() -> str:
+    lineas: list[str] = []
+    for m in _metricas:
+        lineas.extend(m.exponer())
+    return "\n".join(lineas) + "\n"
+
+
+etapas = Histograma("rag_etapa_segundos", "Duración de cada etapa de consulta e ingesta.", ("etapa",))
+http = Histograma("rag_http_segundos", "Duración total de los requests HTTP.", ("metodo", "ruta", "codigo"))
+tokens = Contador("rag_tokens_estimados_total", "Tokens estimados enviados al LLM y generados.", ("tipo",))
+
+
+def observar(etapa: str, segundos: float) -> None:
+    etapas.observar(segundos, etapa=etapa)
+    actual = tiempos_request.get()
+    if actual is not None:
+        actual[etapa] = actual.get(etapa, 0.0) + segundos
+
+
+@contextmanager
+def medir(etapa: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar(etapa, time.perf_counter() - t0)
+
+
+def server_timing(tiempos: dict) -> str:
+    return ", ".join(f"{etapa};dur={s * 1000:.1f}" for etapa, s in tiempos.items())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -13,3 +13,12 @@ class History(Base):
     user_rut = Column(String, ForeignKey("users.rut"))
 
     user = relationship("User", back_populates="historial")
+
+    # el historial de un usuario se lee siempre por fecha descendente
+    __table_args__ = (Index("ix_histories_user_rut_timestamp", "user_rut", "timestamp"),)
+
+# búsqueda de texto en preguntas anteriores (solo PostgreSQL; otras bases usan LIKE)
+FTS_INDICE = (
+    "CREATE INDEX IF NOT EXISTS ix_histories_pregunta_fts "
+    "ON histories USING GIN (to_tsvector('spanish', pregunta))"
+)
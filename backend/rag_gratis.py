@@ -1,77 +1,147 @@
 # backend/rag_gratis.py
 from __future__ import annotations
+import json
 import os
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from sqlalchemy.orm import Session
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
+from fastapi.responses import StreamingResponse
 
-from database import get_db
-from models.history import History
-from models.user import User
-from routers.auth import get_current_user
+import almacen
+import metricas
+from cache_embeddings import EmbeddingsCacheados
+from cache_respuestas import CacheRespuestas, ResultadoCache, normalizar_pregunta
+from colecciones import GENERAL, Coleccion, ColeccionInvalida, GestorColecciones
+from concurrencia import LimitadorAsync, LockArchivo, Saturado
+from contexto import ensamblar as ensamblar_contexto, estimar_tokens
+from enrutador_llm import EnrutadorLLM
+from indices_ann import ajustar_busqueda, borrados, describir, reporte_recall, similitud
+from metricas import medir
+from indexador import Manifiesto, quitar_documento, requiere_reconstruccion, sincronizar
+from lotes import AgrupadorLotes, Coalescedor
+from recuperacion import IndiceBM25, Reranker, fusion_rrf
+from routers.auth import Principal, get_current_claims, verificar_admin
+from routers.history import buffer_historial
 from schemas.pregunta import PreguntaRequest, RespuestaResponse
+from trabajos import ColaLlena, GestorTrabajos, Trabajo
 
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_ollama import ChatOllama
-from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
 
 router = APIRouter(tags=["rag"])  # SIN prefijo; si quieres /rag/* usa: prefix="/rag"
 
 # --- rutas absolutas respecto a backend/ ---
 BASE_DIR: Path = Path(__file__).resolve().parent
-DATA_PATH: Path = BASE_DIR / "data"
-INDEX_DIR: Path = BASE_DIR / "faiss_store"   # <<--- coincide con tu repo
+DATA_PATH: Path = Path(os.getenv("RAG_DATA_DIR", BASE_DIR / "data"))
+INDEX_DIR: Path = Path(os.getenv("RAG_INDEX_DIR", BASE_DIR / "faiss_store"))   # <<--- coincide con tu repo
+# colección "general" en DATA_PATH/INDEX_DIR; las demás en DATA_PATH/<nombre> e
+# INDEX_DIR/colecciones/<nombre>, cada una con su manifiesto y su bm25.json
+# sobrevive a reconstrucciones del índice: no lo borra almacen.borrar
+CACHE_EMBEDDINGS_PATH: Path = INDEX_DIR / "embeddings.sqlite"
 
 EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen2.5:7b")
+# uno o más servidores Ollama (separados por coma); las generaciones se reparten entre ellos
+OLLAMA_URLS = [u.strip() for u in os.getenv("OLLAMA_URLS", os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")).split(",") if u.strip()]
+OLLAMA_MODELO_RESPALDO = os.getenv("OLLAMA_MODELO_RESPALDO", "")  # p.ej. qwen2.5:3b
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
 
-embedding_model = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
+# recuperación: RAG_CANDIDATOS de FAISS y de BM25 fusionados por RRF (el cross-encoder,
+# opcional, reordena los primeros) van en orden a ensamblar_contexto, que une, descarta
+# casi-duplicados y llena el presupuesto de tokens con como mucho RAG_K fragmentos
+RAG_K = int(os.getenv("RAG_K", "3"))
+RAG_HIBRIDO = os.getenv("RAG_HIBRIDO", "1") != "0"
+RAG_CANDIDATOS = int(os.getenv("RAG_CANDIDATOS", "20"))
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+RERANKER_MODELO = os.getenv("RAG_RERANKER_MODELO", "")  # p.ej. cross-encoder/mmarco-mMiniLMv2-L12-H384-v1
+RERANKER_TOP = int(os.getenv("RAG_RERANKER_TOP", "20"))
+reranker: Optional[Reranker] = Reranker(RERANKER_MODELO) if RERANKER_MODELO else None
 
-# carga índice si existe
-vectorstore: Optional[FAISS] = None
-try:
-    vectorstore = FAISS.load_local(
-        str(INDEX_DIR),
-        embeddings=embedding_model,
-        allow_dangerous_deserialization=True,  # OK si el índice lo creaste tú
-    )
-except Exception as e:
-    print(f"[FAISS] No se pudo cargar índice local, se creará uno nuevo si hay PDFs: {e}")
-    vectorstore = None
+# --- recursos pesados: se cargan en inicializar(), fuera del import ---
+embedding_model: Optional[EmbeddingsCacheados] = None  # HuggingFaceEmbeddings con cache en disco
+cache_respuestas: Optional[CacheRespuestas] = None  # RAG_CACHE_ACTIVO=0 lo desactiva
+
+# varios workers (uvicorn --workers N): cualquiera acepta ingestas; el lock de archivo
+# de la colección (col.lock_disco) deja escribir a uno a la vez y los demás recargan
+# cuando cambia el manifiesto. RAG_INDICE_MMAP=1 abre el índice con mmap para leerlo;
+# antes de escribir se relee a memoria. Con faiss 1.10 el mmap solo deja en el page
+# cache compartido las listas de IVF; Flat y HNSW se copian a memoria igual.
+INDICE_MMAP = os.getenv("RAG_INDICE_MMAP", "0") == "1"
+RECARGA_SEGUNDOS = float(os.getenv("RAG_RECARGA_SEGUNDOS", "5"))
+
+# --- colecciones: cargadas a demanda y acotadas en memoria (0 = sin límite) ---
+# Concurrencia por colección (ver colecciones.py): las búsquedas toman el lado lector
+# de `col.lock`; las modificaciones en el lugar (add/delete) el escritor, solo mientras
+# tocan FAISS. `col.escritor`: un trabajo de ingesta a la vez por colección.
+MEMORIA_COLECCIONES = int(float(os.getenv("RAG_COLECCIONES_MEMORIA_MB", "0")) * 1024 * 1024)
+# una consulta a varias colecciones busca en todas en paralelo (FAISS suelta el GIL)
+_pool_fanout = ThreadPoolExecutor(max_workers=int(os.getenv("RAG_FANOUT_WORKERS", "4")), thread_name_prefix="fanout")
 
-def guardar_vectorstore() -> None:
-    if vectorstore is not None:
-        INDEX_DIR.mkdir(parents=True, exist_ok=True)
-        vectorstore.save_local(str(INDEX_DIR))
+# --- turnos del LLM: pocas generaciones a la vez por servidor Ollama y una cola acotada ---
+limitador_llm = LimitadorAsync(
+    concurrencia=int(os.getenv("RAG_LLM_CONCURRENCIA", "2")) * len(OLLAMA_URLS),
+    max_cola=int(os.getenv("RAG_LLM_COLA", "16")),
+    espera_max=float(os.getenv("RAG_LLM_ESPERA", "30")),
+)
 
-# si no hay índice pero sí PDFs, auto-reindex
-if vectorstore is None and DATA_PATH.exists() and any(DATA_PATH.glob("*.pdf")):
+gestor_trabajos = GestorTrabajos(
+    max_workers=int(os.getenv("RAG_TRABAJOS_WORKERS", "2")),
+    max_pendientes=int(os.getenv("RAG_TRABAJOS_MAX_PENDIENTES", "32")),
+)
+
+def cargar_vectorstore(col: Coleccion) -> Optional[FAISS]:
+    # durante un trabajo de ingesta el índice se modificará: sin mmap
+    mmap = INDICE_MMAP and not col.en_ingesta
     try:
-        splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-        all_splits = []
-        for pdf in sorted(DATA_PATH.glob("*.pdf")):
-            loader = PyPDFLoader(str(pdf))
-            docs = loader.load()
-            all_splits.extend(splitter.split_documents(docs))
-        if all_splits:
-            vectorstore = FAISS.from_documents(all_splits, embedding_model)
-            guardar_vectorstore()
-            print(f"[FAISS] Índice creado automáticamente desde {len(list(DATA_PATH.glob('*.pdf')))} PDFs.")
+        vs = almacen.cargar(col.index_dir, embedding_model, mmap=mmap)
     except Exception as e:
-        print("[FAISS] Error al auto-reindexar:", repr(e))
-        traceback.print_exc()
+        print(f"[FAISS] No se pudo cargar el índice de '{col.nombre}', se creará uno nuevo si hay PDFs: {e}")
+        return None
+    col.mapeada = mmap and vs is not None
+    if vs is not None:
+        ajustar_busqueda(vs.index)
+    return vs
 
-# LLM
-llm = ChatOllama(model=OLLAMA_MODEL, temperature=0)
+@medir("ingesta_guardado")
+def guardar_coleccion(col: Coleccion) -> None:
+    if col.vectorstore is not None:
+        almacen.guardar(col.index_dir, col.vectorstore)
+        if col.bm25 is not None:
+            col.bm25.guardar(col.bm25_path)
+    else:
+        # índice vacío: que no vuelva a cargarse el anterior al reiniciar
+        almacen.borrar(col.index_dir, extras=[col.bm25_path.name])
+    col.manifiesto.guardar()
+    col.mtime_manifiesto = _mtime(col.manifiesto_path)
 
+@contextmanager
+def escribiendo(col: Coleccion):
+    """Un trabajo de ingesta a la vez por colección, también entre workers: toma
+    `col.escritor` y el lock de archivo. Con ambos, relee de disco lo que otro worker
+    haya guardado (o la copia con mmap, que no se puede modificar) y la deja cargada."""
+    with col.escritor, col.lock_disco.tomar():
+        col.en_ingesta = True
+        try:
+            if col.cargada and (col.mapeada or _mtime(col.manifiesto_path) != col.mtime_manifiesto):
+                if colecciones.recargar(col):
+                    invalidar_cache()
+            colecciones.cargar_varias([col.nombre])
+            yield
+        finally:
+            col.en_ingesta = False
+
+# LLM
 system_prompt = """Eres un asistente experto en el análisis y consulta de documentos PDF.
 Tu tarea es proporcionar respuestas precisas y detalladas basadas en el contenido de los documentos cargados. 
 Cuando se te haga una pregunta, debes buscar información relevante dentro de los documentos procesados y dar una respuesta que refleje directamente los datos contenidos en ellos. Si la información solicitada no está presente en los documentos o no puede ser inferida con certeza, debes indicar claramente que no dispones de la información necesaria.
@@ -82,65 +152,599 @@ CONTEXTO:
 {context}
 """
 prompt = ChatPromptTemplate.from_messages([("system", system_prompt), ("human", "{input}")])
-stuff_chain = create_stuff_documents_chain(llm, prompt)
+# una cadena por servidor y modelo; el enrutador elige cuál usa cada generación
+enrutador_llm = EnrutadorLLM(
+    OLLAMA_URLS,
+    OLLAMA_MODEL,
+    fabrica_llm=lambda url, modelo: ChatOllama(model=modelo, base_url=url, temperature=0, keep_alive=OLLAMA_KEEP_ALIVE),
+    fabrica_cadena=lambda llm: create_stuff_documents_chain(llm, prompt),
+    modelo_respaldo=OLLAMA_MODELO_RESPALDO,
+    cola=lambda: limitador_llm.esperando,
+    umbral_respaldo=int(os.getenv("RAG_LLM_RESPALDO_COLA", "8")),
+    keep_alive=OLLAMA_KEEP_ALIVE,
+    intervalo_salud=float(os.getenv("RAG_LLM_SALUD_SEGUNDOS", "10")),
+    timeout_salud=float(os.getenv("RAG_LLM_SALUD_TIMEOUT", "2")),
+    lento_salud=float(os.getenv("RAG_LLM_SALUD_LENTO", "2")),
+    fallos_expulsion=int(os.getenv("RAG_LLM_FALLOS_EXPULSION", "3")),
+    segundos_expulsion=float(os.getenv("RAG_LLM_EXPULSION_SEGUNDOS", "30")),
+)
+
+SIN_INFORMACION = "No tengo suficiente información para responder con certeza."
+
+# --- motor de consulta: se arma por consulta con las colecciones pedidas ---
+class MotorConsulta:
+    # No guarda índices: el vectorstore y el BM25 de cada colección se leen bajo
+    # su lock al buscar, así una reindexación o una descarga nunca queda a medias.
+    def __init__(self, cols: list[Coleccion], k: int = RAG_K):
+        self.colecciones = cols
+        self.k = k
+        # alguna colección se descargó a mitad de la consulta: el contexto está incompleto
+        self.incompleta = False
+
+    def _candidatos(self, col: Coleccion, preguntas: list[str], vectores: np.ndarray, n: int) -> list[tuple[list, list]]:
+        """Por pregunta: [(similitud, id)] de FAISS y [(id, puntaje)] de BM25 en `col`."""
+        with col.lock.lectura():
+            vs, bm25 = col.vectorstore, col.bm25
+            if vs is None:
+                self.incompleta = self.incompleta or not col.cargada
+                return [([], [])] * len(preguntas)
+            # las lápidas de HNSW/IVF (chunks borrados) se saltan: se piden unas de más
+            with medir("faiss"):
+                distancias, posiciones = vs.index.search(vectores, n + min(borrados(vs), n))
+                similitudes = similitud(vs.index, distancias)
+            mapa = vs.index_to_docstore_id
+            salida = []
+            for pregunta, fila, sims in zip(preguntas, posiciones, similitudes):
+                densos = [(float(x), mapa[int(p)]) for p, x in zip(fila, sims) if int(p) in mapa][:n]
+                lexicos = []
+                if bm25 is not None:
+                    with medir("bm25"):
+                        lexicos = bm25.buscar(pregunta, n)
+                salida.append((densos, lexicos))
+            return salida
+
+    def _documentos(self, ids: list[str], origen: dict[str, Coleccion]) -> list[Document]:
+        docs = []
+        for i in ids:
+            col = origen[i]
+            with col.lock.lectura():
+                vs = col.vectorstore
+                d = vs.docstore.search(i) if vs is not None else None
+                if vs is None:
+                    self.incompleta = True
+            if isinstance(d, Document):
+                # copia: el docstore en memoria devuelve sus propios objetos
+                docs.append(Document(id=d.id, page_content=d.page_content, metadata={**d.metadata, "coleccion": col.nombre}))
+        return docs
+
+    def recuperar_lote(self, preguntas: list[str], vectores: Optional[np.ndarray] = None) -> list[list[Document]]:
+        """Recupera para varias preguntas con un FAISS search por colección."""
+        if vectores is None:
+            with medir("embedding_consulta"):
+                vectores = embedding_model.embed_consultas(preguntas)
+        vectores = np.ascontiguousarray(vectores, dtype="float32")
+        n = max(self.k, RAG_CANDIDATOS)
+        if len(self.colecciones) == 1:
+            por_coleccion = [self._candidatos(self.colecciones[0], preguntas, vectores, n)]
+        else:
+            with medir("fanout"):
+                por_coleccion = list(_pool_fanout.map(lambda c: self._candidatos(c, preguntas, vectores, n), self.colecciones))
+
+        resultados = []
+        for q, pregunta in enumerate(preguntas):
+            # top-n global entre colecciones. Las similitudes son comparables (mismo
+            # modelo); los puntajes BM25 usan el IDF de cada colección y se comparan
+            # igual, como hacen los shards de un buscador distribuido.
+            densos, lexicos = [], []
+            for col, candidatos in zip(self.colecciones, por_coleccion):
+                d, l = candidatos[q]
+                densos.extend((sim, i, col) for sim, i in d)
+                lexicos.extend((puntaje, i, col) for i, puntaje in l)
+            densos = sorted(densos, key=lambda x: x[0], reverse=True)[:n]
+            lexicos = sorted(lexicos, key=lambda x: x[0], reverse=True)[:n]
+            origen: dict[str, Coleccion] = {}
+            for _, i, col in densos + lexicos:
+                origen.setdefault(i, col)  # el mismo chunk en dos colecciones: es el mismo texto
+            ids = list(dict.fromkeys(i for _, i, _ in densos))
+            if RAG_HIBRIDO:
+                ids = fusion_rrf([ids, [i for _, i, _ in lexicos]], k=RAG_RRF_K)
+            ids = ids[:RERANKER_TOP] if reranker else ids[:n]
+            with medir("docstore"):
+                resultados.append(self._documentos(ids, origen))
+        if reranker:
+            with medir("reranker"):
+                resultados = [
+                    [docs[i] for i in reranker.ordenar(p, [d.page_content for d in docs])] for p, docs in zip(preguntas, resultados)
+                ]
+        # el contexto se arma aquí: las fuentes describen lo mismo que ve el LLM. Recibe
+        # todos los candidatos: el lugar que liberan las uniones y los duplicados lo
+        # ocupa el siguiente candidato distinto, sin pasar de k fragmentos
+        with medir("contexto"):
+            return [ensamblar_contexto(docs, max_fragmentos=self.k) for docs in resultados]
+
+    def recuperar(self, pregunta: str) -> list[Document]:
+        return self.recuperar_lote([pregunta])[0]
+
+async def generar(pregunta: str, docs: list[Document]) -> str:
+    contar_prompt(pregunta, docs)
+    with medir("llm"):
+        ans = await enrutador_llm.invocar({"input": pregunta, "context": docs}) or SIN_INFORMACION
+    metricas.tokens.inc(estimar_tokens(ans), tipo="respuesta")
+    return ans
+
+async def generar_stream(pregunta: str, docs: list[Document]) -> AsyncIterator[str]:
+    contar_prompt(pregunta, docs)
+    inicio = time.perf_counter()
+    primero = True
+    async for token in enrutador_llm.stream({"input": pregunta, "context": docs}):
+        if primero:
+            # prefill: lo que tarda Ollama en procesar el prompt
+            metricas.observar("llm_primer_token", time.perf_counter() - inicio)
+            primero = False
+        metricas.tokens.inc(estimar_tokens(token), tipo="respuesta")
+        yield token
+    metricas.observar("llm", time.perf_counter() - inicio)
+
+def contar_prompt(pregunta: str, docs: list[Document]) -> None:
+    texto = system_prompt + pregunta + "".join(d.page_content for d in docs)
+    metricas.tokens.inc(estimar_tokens(texto), tipo="prompt")
+
+# instala `vs` (y su BM25) como índice activo de la colección
+def publicar_coleccion(col: Coleccion, vs: Optional[FAISS], bm25: Optional[IndiceBM25] = None) -> None:
+    col.instalar(vs, bm25 if bm25 is not None else col.bm25)
+    invalidar_cache()
+
+def invalidar_cache() -> None:
+    if cache_respuestas is not None:
+        cache_respuestas.invalidar()
+
+def _mtime(ruta: Path) -> float:
+    try:
+        return ruta.stat().st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+def _cargar_coleccion(col: Coleccion) -> None:
+    col.manifiesto = Manifiesto.cargar(col.manifiesto_path)
+    col.mtime_manifiesto = _mtime(col.manifiesto_path)
+    vs = cargar_vectorstore(col)
+    bm25 = IndiceBM25.cargar(col.bm25_path) if RAG_HIBRIDO else None
+    # BM25 se deriva del docstore: si falta o quedó desfasado se completa al cargar
+    if bm25 is not None and vs is not None and any(bm25.sincronizar(vs)):
+        # solo si nadie escribe la colección (otro worker, o el trabajo que la recarga)
+        with col.lock_disco.tomar(bloquear=False) as propio:
+            if propio:
+                bm25.guardar(col.bm25_path)
+    col.instalar(vs, bm25)
+    print(f"[FAISS] Colección '{col.nombre}' cargada ({describir(getattr(vs, 'index', None))['vectores']} vectores).")
+
+colecciones = GestorColecciones(DATA_PATH, INDEX_DIR, _cargar_coleccion, MEMORIA_COLECCIONES)
+
+# --- arranque perezoso: el servidor acepta conexiones y esto corre en segundo plano ---
+_estado_inicio = {"fase": "pendiente", "listo": False, "error": None, "segundos": None}
+_inicio_lock = threading.Lock()
+_inicio_hilo: Optional[threading.Thread] = None
+
+def inicializar() -> None:
+    global embedding_model, cache_respuestas
+    t0 = time.monotonic()
+    try:
+        _estado_inicio["fase"] = "cargando_modelo"
+        embedding_model = EmbeddingsCacheados(
+            HuggingFaceEmbeddings(model_name=EMBED_MODEL), CACHE_EMBEDDINGS_PATH, EMBED_MODEL
+        )
+        if os.getenv("RAG_CACHE_ACTIVO", "1") != "0":
+            cache_respuestas = CacheRespuestas(
+                embedding_model,
+                umbral=float(os.getenv("RAG_CACHE_UMBRAL", "0.92")),
+                max_entradas=int(os.getenv("RAG_CACHE_MAX_ENTRADAS", "512")),
+                ttl_segundos=float(os.getenv("RAG_CACHE_TTL", "3600")),
+            )
+
+        # las demás colecciones se cargan con su primera consulta
+        _estado_inicio["fase"] = "cargando_indice"
+        colecciones.asegurar_cargada(colecciones.obtener(GENERAL))
+        _estado_inicio.update(fase="listo", listo=True, segundos=round(time.monotonic() - t0, 2))
+        print(f"[RAG] Listo en {_estado_inicio['segundos']}s.")
+    except Exception as e:
+        print("[RAG] Error al inicializar:", repr(e))
+        traceback.print_exc()
+        _estado_inicio.update(fase="error", error=f"{type(e).__name__}: {e}")
+        return
+
+    if RECARGA_SEGUNDOS > 0:
+        threading.Thread(target=_vigilar_indice, name="recarga-indice", daemon=True).start()
+    # colecciones con PDFs pero sin índice: auto-reindex (como trabajo, sin bloquear).
+    # Con varios workers lo intentan todos; el primero indexa y los demás, al tomar el
+    # lock, recargan su índice y no encuentran cambios
+    sin_indice = [n for n in colecciones.nombres() if colecciones.obtener(n).pdfs() and not colecciones.obtener(n).tiene_indice()]
+    if sin_indice:
+        trabajo = gestor_trabajos.enviar("reindex", _trabajo_reindexar, sin_indice)
+        print(f"[FAISS] Sin índice local para {sin_indice}: reindexado automático en el trabajo {trabajo.id}.")
+
+def _vigilar_indice() -> None:
+    # recarga una colección cargada cuando otro worker guarda su manifiesto nuevo (las
+    # no cargadas se leerán frescas al usarlas). Con un trabajo de este worker en curso
+    # se salta: escribiendo() ya relee antes de modificarla
+    while True:
+        time.sleep(RECARGA_SEGUNDOS)
+        for col in colecciones.registradas():
+            if not col.cargada or _mtime(col.manifiesto_path) == col.mtime_manifiesto:
+                continue
+            if not col.escritor.acquire(blocking=False):
+                continue
+            try:
+                if colecciones.recargar(col):
+                    invalidar_cache()
+                    print(f"[FAISS] Colección '{col.nombre}' recargada tras un cambio en disco.")
+            except Exception as e:
+                print(f"[FAISS] Error al recargar '{col.nombre}':", repr(e))
+            finally:
+                col.escritor.release()
+
+def iniciar_en_segundo_plano() -> None:
+    global _inicio_hilo
+    with _inicio_lock:
+        if _inicio_hilo is None:
+            _inicio_hilo = threading.Thread(target=inicializar, name="inicio-rag", daemon=True)
+            _inicio_hilo.start()
+            enrutador_llm.iniciar()  # chequeos de salud y precarga de modelos
+
+def estado_inicio() -> dict:
+    return dict(_estado_inicio)
+
+def esta_listo() -> bool:
+    return _estado_inicio["listo"]
+
+def cerrar() -> None:
+    enrutador_llm.cerrar()
+    gestor_trabajos.cerrar()
+    buffer_historial.cerrar()
+
+def requiere_listo() -> None:
+    if not esta_listo():
+        raise HTTPException(
+            status_code=503,
+            detail=f"El servicio RAG se está iniciando ({_estado_inicio['fase']}).",
+            headers={"Retry-After": "5"},
+        )
+
+async def entrar_turno_llm() -> float:
+    try:
+        return await limitador_llm.entrar()
+    except Saturado as e:
+        headers = {"Retry-After": str(e.reintentar)}
+        if e.posicion is not None:
+            # cola llena: 429 con la posición que habría tenido
+            raise HTTPException(
+                status_code=429,
+                detail={"mensaje": str(e), "posicion_en_cola": e.posicion, "reintentar_en": e.reintentar},
+                headers=headers,
+            )
+        raise HTTPException(status_code=503, detail={"mensaje": str(e), "reintentar_en": e.reintentar}, headers=headers)
+
+def _coleccion(nombre: str, crear: bool = False) -> Coleccion:
+    try:
+        col = colecciones.obtener(nombre, crear=crear)
+    except ColeccionInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if col is None:
+        raise HTTPException(status_code=404, detail=f"No existe la colección '{nombre}'")
+    return col
+
+def resolver_colecciones(pedidas: Optional[list[str]] = None) -> tuple[str, ...]:
+    """Colecciones de una consulta; sin `pedidas`, todas las que tienen índice."""
+    if not pedidas:
+        return tuple(n for n in colecciones.nombres() if colecciones.obtener(n).tiene_indice())
+    return tuple(sorted({_coleccion(n).nombre for n in pedidas}))
+
+def _hay_indice(nombres: tuple[str, ...]) -> bool:
+    return any(colecciones.obtener(n).tiene_indice() for n in nombres)
+
+def _ambito(nombres: tuple[str, ...]) -> str:
+    # el cache de respuestas y el coalescedor separan por conjunto de colecciones
+    return ",".join(nombres)
+
+def _preparar_lote(pedidos: list[tuple[tuple[str, ...], str]]) -> list[tuple[Optional[ResultadoCache], list[Document]]]:
+    # un embed para todas las preguntas del lote y un FAISS search por colección;
+    # las que están en el cache de respuestas no se recuperan
+    preguntas = [p for _, p in pedidos]
+    with medir("embedding_consulta"):
+        vectores = np.asarray(embedding_model.embed_consultas(preguntas), dtype="float32")
+    with medir("cache_respuestas"):
+        previos = [
+            cache_respuestas.buscar(p, vector=v, ambito=_ambito(nombres)) if cache_respuestas else None
+            for (nombres, p), v in zip(pedidos, vectores)
+        ]
+    grupos: dict[tuple[str, ...], list[int]] = {}
+    for i, previo in enumerate(previos):
+        if previo is None or not previo.acierto:
+            grupos.setdefault(pedidos[i][0], []).append(i)
+    docs: dict[int, list[Document]] = {}
+    for nombres, indices in grupos.items():
+        # cargar las colecciones que falten puede tardar: ocurre aquí, fuera del event loop
+        t = time.perf_counter()
+        with colecciones.fijar(list(nombres)) as cols:
+            metricas.observar("carga_colecciones", time.perf_counter() - t)
+            motor = MotorConsulta(cols)
+            recuperados = motor.recuperar_lote([preguntas[i] for i in indices], vectores[indices])
+        docs.update(zip(indices, recuperados))
+        if motor.incompleta:
+            # no debería pasar con las colecciones fijadas; si pasa, no se cachea
+            print(f"[colecciones] {list(nombres)} descargada durante la consulta; respuesta sin cache.")
+            for i in indices:
+                previos[i] = None
+    return [(previo, docs.get(i, [])) for i, previo in enumerate(previos)]
+
+agrupador_consultas = AgrupadorLotes(
+    _preparar_lote,
+    ventana_ms=float(os.getenv("RAG_LOTE_VENTANA_MS", "5")),
+    max_lote=int(os.getenv("RAG_LOTE_MAX", "32")),
+)
+# preguntas iguales (normalizadas) en curso comparten una sola generación
+coalescedor = Coalescedor()
 
-def responder_con_rag(pregunta: str) -> str:
-    if not vectorstore:
+async def _responder(pregunta: str, nombres: tuple[str, ...]) -> str:
+    with medir("recuperacion"):
+        previo, docs = await agrupador_consultas.pedir((nombres, pregunta))
+    if previo is not None and previo.acierto:
+        return previo.respuesta
+
+    with medir("cola_llm"):
+        inicio = await entrar_turno_llm()
+    try:
+        ans = await generar(pregunta, docs)
+    finally:
+        limitador_llm.salir(inicio)
+    if previo is not None:
+        cache_respuestas.guardar(pregunta, ans, describir_fuentes(docs), previo, ambito=_ambito(nombres))
+    return ans
+
+async def responder_con_rag(pregunta: str, nombres: Optional[tuple[str, ...]] = None) -> str:
+    nombres = resolver_colecciones() if nombres is None else nombres
+    if not _hay_indice(nombres):
         return "⚠️ No hay documentos indexados."
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
-    rag = create_retrieval_chain(retriever, stuff_chain)
-    out = rag.invoke({"input": pregunta})
-    return out.get("answer") or out.get("output_text") or "No tengo suficiente información para responder con certeza."
+    clave = (_ambito(nombres), normalizar_pregunta(pregunta))
+    return await coalescedor.ejecutar(clave, lambda: _responder(pregunta, nombres))
+
+def describir_fuentes(docs: list[Document]) -> list[dict]:
+    fuentes = []
+    for d in docs:
+        page = d.metadata.get("page")
+        fuentes.append({
+            "coleccion": d.metadata.get("coleccion"),
+            "archivo": Path(d.metadata.get("source", "")).name,
+            "pagina": page + 1 if isinstance(page, int) else None,
+            "fragmento": d.page_content[:200],
+        })
+    return fuentes
+
+def _evento_sse(evento: str, datos) -> str:
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+class _StreamConTurno(StreamingResponse):
+    """Libera el turno del LLM cuando termina la respuesta, aunque el cliente se
+    desconecte antes de que se empiece a iterar el cuerpo (ahí el `finally` del
+    generador nunca corre). `liberar` debe poder llamarse más de una vez."""
+
+    def __init__(self, contenido, liberar, **kwargs):
+        super().__init__(contenido, **kwargs)
+        self._liberar = liberar
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._liberar()
+
+def _indice_de(col: Coleccion):
+    return getattr(col.vectorstore, "index", None)
 
 @router.get("/status")
 def status():
-    n_pdfs = len(list(DATA_PATH.glob("*.pdf"))) if DATA_PATH.exists() else 0
-    index_size = getattr(getattr(vectorstore, "index", None), "ntotal", 0) if vectorstore else 0
+    cargadas = [c for c in colecciones.registradas() if c.cargada]
+    general = colecciones.obtener(GENERAL)
     return {
         "data_path": str(DATA_PATH),
         "index_dir": str(INDEX_DIR),
-        "pdfs_en_data": n_pdfs,
-        "docs_en_indice": index_size,
+        "pdfs_en_data": sum(len(colecciones.obtener(n).pdfs()) for n in colecciones.nombres()),
+        "docs_en_indice": sum(describir(_indice_de(c))["vectores"] for c in cargadas),
+        "indice": describir(_indice_de(general)),
         "embedding_model": EMBED_MODEL,
         "ollama_model": OLLAMA_MODEL,
-        "index_cargado": bool(vectorstore),
+        "index_cargado": any(c.vectorstore is not None for c in cargadas),
+        "colecciones": colecciones.estadisticas(),
+        "cache_respuestas": cache_respuestas.estadisticas() if cache_respuestas else None,
+        "cache_embeddings": embedding_model.estadisticas() if embedding_model else None,
+        "llm": limitador_llm.estadisticas(),
+        "backends_llm": enrutador_llm.estadisticas(),
+        "lotes_consulta": agrupador_consultas.estadisticas(),
+        "coalescidas": coalescedor.estadisticas(),
+        "historial": buffer_historial.estadisticas(),
+        "inicio": estado_inicio(),
+        "escritura_entre_procesos": LockArchivo.entre_procesos,
     }
 
+# --- valores que /metrics lee al exponer (ver metricas.py) ---
+def _stats_caches() -> dict:
+    valores = {}
+    if cache_respuestas is not None:
+        st = cache_respuestas.estadisticas()
+        valores.update({("respuestas", "acierto"): st["aciertos"], ("respuestas", "fallo"): st["fallos"]})
+    if embedding_model is not None:
+        st = embedding_model.estadisticas()
+        valores.update({("embeddings", "acierto"): st["aciertos"], ("embeddings", "fallo"): st["fallos"]})
+    return valores
+
+def _por_coleccion(campo: str) -> dict:
+    return {c.nombre: describir(_indice_de(c))[campo] for c in colecciones.registradas() if c.cargada}
+
+metricas.Medidor("rag_indice_vectores", "Vectores en el índice de cada colección cargada.",
+                 lambda: _por_coleccion("vectores"), etiquetas=("coleccion",))
+metricas.Medidor("rag_indice_memoria_bytes", "Memoria estimada del índice de cada colección cargada.",
+                 lambda: _por_coleccion("memoria_bytes"), etiquetas=("coleccion",))
+metricas.Medidor("rag_colecciones_descargas_total", "Colecciones descargadas por el presupuesto de memoria.",
+                 lambda: {(): colecciones.descargas}, tipo="counter")
+metricas.Medidor("rag_cache_total", "Consultas a los caches por resultado.", _stats_caches,
+                 etiquetas=("cache", "resultado"), tipo="counter")
+metricas.Medidor("rag_llm_en_curso", "Generaciones en curso contra Ollama.", lambda: {(): limitador_llm.en_curso})
+metricas.Medidor("rag_llm_en_espera", "Consultas esperando turno del LLM.", lambda: {(): limitador_llm.esperando})
+metricas.Medidor("rag_llm_rechazadas_total", "Consultas rechazadas por saturación (429/503).",
+                 lambda: {(): limitador_llm.rechazados}, tipo="counter")
+metricas.Medidor("rag_llm_backend_en_curso", "Generaciones en curso por servidor Ollama.",
+                 lambda: {b.url: b.en_curso for b in enrutador_llm.backends}, etiquetas=("backend",))
+metricas.Medidor("rag_llm_backend_disponible", "1 si el servidor Ollama recibe generaciones.",
+                 lambda: {b.url: int(b.disponible(time.monotonic())) for b in enrutador_llm.backends}, etiquetas=("backend",))
+metricas.Medidor("rag_llm_backend_fallos_total", "Generaciones fallidas por servidor Ollama.",
+                 lambda: {b.url: b.fallos for b in enrutador_llm.backends}, etiquetas=("backend",), tipo="counter")
+metricas.Medidor("rag_llm_backend_expulsiones_total", "Veces que un servidor Ollama quedó fuera por fallos seguidos.",
+                 lambda: {b.url: b.expulsiones for b in enrutador_llm.backends}, etiquetas=("backend",), tipo="counter")
+metricas.Medidor("rag_llm_respaldo_total", "Generaciones con el modelo de respaldo por cola larga.",
+                 lambda: {(): enrutador_llm.respaldos}, tipo="counter")
+metricas.Medidor("rag_coalescidas_total", "Preguntas que compartieron una generación en curso.",
+                 lambda: {(): coalescedor.compartidas}, tipo="counter")
+metricas.Medidor("rag_historial_pendiente", "Filas de historial esperando escritura.",
+                 lambda: {(): buffer_historial.pendientes()})
+metricas.Medidor("rag_trabajos_pendientes", "Trabajos de ingesta pendientes o en curso.",
+                 lambda: {(): gestor_trabajos.pendientes()})
+
+@router.get("/indice/reporte", dependencies=[Depends(requiere_listo)])
+def reporte_indice(consultas: int = 100, k: int = 10, coleccion: str = GENERAL, user: Principal = Depends(verificar_admin)):
+    # fijada para que no se descargue a mitad del barrido; el lock se toma por pasos
+    with colecciones.fijar([_coleccion(coleccion).nombre]) as (col,):
+        vs = col.vectorstore
+        if vs is None:
+            raise HTTPException(status_code=400, detail=f"La colección '{col.nombre}' no tiene índice")
+        return reporte_recall(vs, embedding_model, n_consultas=consultas, k=k, lectura=col.lock.lectura)
+
+@router.get("/colecciones")
+def listar_colecciones():
+    return colecciones.estadisticas()
+
 @router.get("/files")
-def listar_documentos():
-    DATA_PATH.mkdir(parents=True, exist_ok=True)
-    archivos = sorted([p.name for p in DATA_PATH.glob("*.pdf")])
-    return {"archivos": archivos}
+def listar_documentos(coleccion: str = GENERAL):
+    col = _coleccion(coleccion)
+    col.data_dir.mkdir(parents=True, exist_ok=True)
+    return {"coleccion": col.nombre, "archivos": [p.name for p in col.pdfs()]}
 
-@router.post("/reindex")
-def reindexar(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    DATA_PATH.mkdir(parents=True, exist_ok=True)
-    pdfs = sorted(DATA_PATH.glob("*.pdf"))
-    if not pdfs:
-        raise HTTPException(status_code=400, detail="No hay PDFs en la carpeta data/")
+# --- trabajos de ingesta (corren en gestor_trabajos, uno a la vez por colección) ---
+def _bm25_para(col: Coleccion, vs: Optional[FAISS], reconstruido: bool) -> Optional[IndiceBM25]:
+    # tras una reconstrucción el índice nuevo aún no es visible: BM25 nuevo y privado;
+    # si no, se actualiza el activo con el mismo lock que protege a FAISS
+    if not RAG_HIBRIDO:
+        return None
+    if reconstruido or col.bm25 is None:
+        bm25 = IndiceBM25()
+        bm25.sincronizar(vs)
+        return bm25
+    with col.lock.escritura():
+        col.bm25.sincronizar(vs)
+    return col.bm25
+
+def _reindexar_coleccion(col: Coleccion, avance) -> dict:
+    with escribiendo(col):
+        pdfs = col.pdfs()
+        nuevo, res = sincronizar(
+            col.vectorstore, pdfs, col.manifiesto, embedding_model,
+            escritura=col.lock.escritura, avance=avance,
+        )
+        if res.hubo_cambios or res.reconstruido:
+            publicar_coleccion(col, nuevo, _bm25_para(col, nuevo, res.reconstruido))
+            guardar_coleccion(col)
 
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-    all_splits = []
-    for pdf in pdfs:
-        loader = PyPDFLoader(str(pdf))
-        docs = loader.load()
-        all_splits.extend(splitter.split_documents(docs))
+    index_size = getattr(getattr(nuevo, "index", None), "ntotal", 0)
+    return {
+        "mensaje": f"✅ '{col.nombre}': reindexado {len(pdfs)} PDFs en {index_size} chunks.",
+        "reconstruido": res.reconstruido,
+        "nuevos": res.nuevos,
+        "modificados": res.modificados,
+        "eliminados": res.eliminados,
+        "sin_cambios": len(res.sin_cambios),
+        "chunks_agregados": res.chunks_agregados,
+        "chunks_duplicados": res.chunks_duplicados,
+        "chunks_eliminados": res.chunks_eliminados,
+    }
+
+def _trabajo_reindexar(trabajo: Trabajo, nombres: Optional[list[str]] = None) -> dict:
+    # sin `nombres`: todas las colecciones con PDFs o con índice (para vaciarlo)
+    if nombres is None:
+        nombres = [n for n in colecciones.nombres() if colecciones.obtener(n).pdfs() or colecciones.obtener(n).tiene_indice()]
+    resultados = {}
+    for j, nombre in enumerate(nombres):
+        def avance(progreso: float, mensaje: str = "", j=j) -> None:
+            trabajo.avance((j + progreso) / len(nombres), mensaje)
+        resultados[nombre] = _reindexar_coleccion(colecciones.obtener(nombre, crear=True), avance)
+    return {
+        "mensaje": " ".join(r["mensaje"] for r in resultados.values()) or "Sin colecciones para reindexar.",
+        "colecciones": resultados,
+    }
 
-    global vectorstore
-    vectorstore = FAISS.from_documents(all_splits, embedding_model)
-    guardar_vectorstore()
+def _trabajo_cargar(trabajo: Trabajo, nombre_coleccion: str, file_path: Path) -> dict:
+    col = colecciones.obtener(nombre_coleccion, crear=True)
+    with escribiendo(col):
+        # con un índice sin manifiesto hay que reconstruir con todos los PDFs
+        pdfs = col.pdfs() if requiere_reconstruccion(col.vectorstore, col.manifiesto) else [file_path]
+        nuevo, res = sincronizar(
+            col.vectorstore, pdfs, col.manifiesto, embedding_model, eliminar_ausentes=False,
+            escritura=col.lock.escritura, avance=trabajo.avance,
+        )
+        publicar_coleccion(col, nuevo, _bm25_para(col, nuevo, res.reconstruido))
+        guardar_coleccion(col)
+    n_chunks = col.manifiesto.documentos.get(file_path.name, {}).get("chunks", 0)
+    return {"mensaje": f"✅ '{file_path.name}' cargado e indexado en '{col.nombre}'.", "coleccion": col.nombre, "chunks": n_chunks}
 
-    index_size = getattr(vectorstore.index, "ntotal", 0)
-    return {"mensaje": f"✅ Reindexado {len(pdfs)} PDFs en {index_size} chunks."}
+def _trabajo_quitar(trabajo: Trabajo, nombre_coleccion: str, nombre: str) -> dict:
+    col = colecciones.obtener(nombre_coleccion, crear=True)
+    with escribiendo(col):
+        nuevo, n_chunks = quitar_documento(
+            col.vectorstore, nombre, col.manifiesto, escritura=col.lock.escritura, embeddings=embedding_model,
+        )
+        if n_chunks or nuevo is not col.vectorstore:
+            publicar_coleccion(col, nuevo, _bm25_para(col, nuevo, False))
+            guardar_coleccion(col)
+    return {"mensaje": f"🗑️ Chunks de '{nombre}' eliminados del índice", "coleccion": col.nombre, "chunks_eliminados": n_chunks}
 
-@router.post("/cargar_documento")
-async def cargar_documento_api(file: UploadFile = File(...)):
+def _encolar(tipo: str, fn, *args) -> Trabajo:
+    try:
+        return gestor_trabajos.enviar(tipo, fn, *args)
+    except ColaLlena as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+@router.get("/trabajos")
+def listar_trabajos():
+    return {"trabajos": [t.como_dict() for t in gestor_trabajos.listar()]}
+
+@router.get("/trabajos/{trabajo_id}")
+def estado_trabajo(trabajo_id: str):
+    trabajo = gestor_trabajos.obtener(trabajo_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return trabajo.como_dict()
+
+@router.post("/reindex", status_code=202, dependencies=[Depends(requiere_listo)])
+def reindexar(
+    coleccion: Optional[str] = Query(None, description="sin valor: todas las colecciones"),
+    user: Principal = Depends(get_current_claims),
+):
+    nombres = [_coleccion(coleccion).nombre] if coleccion else None
+    DATA_PATH.mkdir(parents=True, exist_ok=True)
+    n_pdfs = sum(len(colecciones.obtener(n).pdfs()) for n in (nombres or colecciones.nombres()))
+    if not n_pdfs:
+        raise HTTPException(status_code=400, detail="No hay PDFs en la carpeta data/")
+
+    trabajo = _encolar("reindex", _trabajo_reindexar, nombres)
+    return {"mensaje": f"⏳ Reindexado de {n_pdfs} PDFs en cola.", "trabajo_id": trabajo.id, "estado": trabajo.estado}
+
+@router.post("/cargar_documento", status_code=202, dependencies=[Depends(requiere_listo)])
+async def cargar_documento_api(file: UploadFile = File(...), coleccion: str = GENERAL):
     try:
         if not file.filename.lower().endswith(".pdf"):
             raise HTTPException(status_code=400, detail="El archivo debe ser .pdf")
 
-        DATA_PATH.mkdir(parents=True, exist_ok=True)
-        file_path = DATA_PATH / Path(file.filename).name  # seguro
+        # una colección nueva se crea con su primer PDF
+        col = _coleccion(coleccion, crear=True)
+        col.data_dir.mkdir(parents=True, exist_ok=True)
+        file_path = col.data_dir / Path(file.filename).name  # seguro
 
         with open(file_path, "wb") as out:
             while True:
@@ -149,19 +753,14 @@ async def cargar_documento_api(file: UploadFile = File(...)):
                     break
                 out.write(chunk)
 
-        loader = PyPDFLoader(str(file_path))
-        docs = loader.load()
-        splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-        splits = splitter.split_documents(docs)
-
-        global vectorstore
-        if vectorstore:
-            vectorstore.add_documents(splits)
-        else:
-            vectorstore = FAISS.from_documents(splits, embedding_model)
-        guardar_vectorstore()
-
-        return {"mensaje": f"✅ '{file.filename}' cargado e indexado.", "chunks": len(splits)}
+        # parseo, embeddings y guardado van en segundo plano
+        trabajo = _encolar("cargar_documento", _trabajo_cargar, col.nombre, file_path)
+        return {
+            "mensaje": f"⏳ '{file.filename}' recibido, indexando en segundo plano.",
+            "coleccion": col.nombre,
+            "trabajo_id": trabajo.id,
+            "estado": trabajo.estado,
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -169,22 +768,96 @@ async def cargar_documento_api(file: UploadFile = File(...)):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"cargar_documento: {type(e).__name__}: {e}")
 
-@router.post("/preguntar", response_model=RespuestaResponse)
-def preguntar(
+@router.post("/preguntar", response_model=RespuestaResponse, dependencies=[Depends(requiere_listo)])
+async def preguntar(
     body: PreguntaRequest,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_claims),
 ):
-    ans = responder_con_rag(body.pregunta)
-    hist = History(pregunta=body.pregunta, respuesta=ans, user_rut=user.rut)
-    db.add(hist)
-    db.commit()
+    ans = await responder_con_rag(body.pregunta, resolver_colecciones(body.colecciones))
+    with medir("historial"):
+        await buffer_historial.agregar(body.pregunta, ans, user.rut)
     return {"respuesta": ans}
 
-@router.delete("/files/{nombre_archivo}")
-def eliminar_documento(nombre_archivo: str):
-    ruta = DATA_PATH / nombre_archivo
-    if ruta.exists():
-        ruta.unlink()
-        return {"mensaje": f"🗑️ Documento '{nombre_archivo}' eliminado correctamente"}
-    raise HTTPException(status_code=404, detail="Archivo no encontrado")
+@router.post("/preguntar/stream", dependencies=[Depends(requiere_listo)])
+async def preguntar_stream(
+    body: PreguntaRequest,
+    user: Principal = Depends(get_current_claims),
+):
+    # el historial se encola al terminar el stream (buffer_historial)
+    pregunta = body.pregunta
+    user_rut = user.rut
+    nombres = resolver_colecciones(body.colecciones)
+    hay_indice = _hay_indice(nombres)
+    previo, docs = None, []
+    inicio = None
+    if hay_indice:
+        with medir("recuperacion"):
+            previo, docs = await agrupador_consultas.pedir((nombres, pregunta))
+        if previo is None or not previo.acierto:
+            # el turno se pide antes de responder: sin cupo, 429/503 en vez de un stream vacío
+            with medir("cola_llm"):
+                inicio = await entrar_turno_llm()
+
+    liberado = False
+
+    def liberar() -> None:
+        nonlocal liberado
+        if inicio is not None and not liberado:
+            liberado = True
+            limitador_llm.salir(inicio)
+
+    async def eventos():
+        partes: list[str] = []
+        try:
+            if not hay_indice:
+                partes.append("⚠️ No hay documentos indexados.")
+                yield _evento_sse("fuentes", [])
+                yield _evento_sse("token", {"texto": partes[0]})
+            elif inicio is None:
+                partes.append(previo.respuesta)
+                yield _evento_sse("fuentes", previo.fuentes)
+                yield _evento_sse("token", {"texto": previo.respuesta})
+            else:
+                fuentes = describir_fuentes(docs)
+                yield _evento_sse("fuentes", fuentes)
+                async for token in generar_stream(pregunta, docs):
+                    partes.append(token)
+                    yield _evento_sse("token", {"texto": token})
+                if previo is not None and partes:
+                    cache_respuestas.guardar(pregunta, "".join(partes), fuentes, previo, ambito=_ambito(nombres))
+        except Exception as e:
+            print("[/preguntar/stream] ERROR:", repr(e))
+            traceback.print_exc()
+            yield _evento_sse("error", {"detalle": f"{type(e).__name__}: {e}"})
+            return
+        finally:
+            liberar()
+
+        ans = "".join(partes) or SIN_INFORMACION
+        with medir("historial"):
+            await buffer_historial.agregar(pregunta, ans, user_rut)
+        yield _evento_sse("fin", {"respuesta": ans})
+
+    return _StreamConTurno(
+        eventos(),
+        liberar,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.delete("/files/{nombre_archivo}", dependencies=[Depends(requiere_listo)])
+def eliminar_documento(nombre_archivo: str, coleccion: str = GENERAL):
+    col = _coleccion(coleccion)
+    ruta = col.data_dir / Path(nombre_archivo).name
+    if not ruta.exists():
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    ruta.unlink()
+    invalidar_cache()
+
+    trabajo = _encolar("eliminar_documento", _trabajo_quitar, col.nombre, ruta.name)
+    return {
+        "mensaje": f"🗑️ Documento '{nombre_archivo}' eliminado correctamente",
+        "coleccion": col.nombre,
+        "trabajo_id": trabajo.id,
+        "estado": trabajo.estado,
+    }
@@ -0,0 +1,159 @@
+# backend/recuperacion.py
+# Recuperación híbrida: BM25 sobre los mismos chunks del índice FAISS, fusión por
+# rangos recíprocos (RRF) y, opcionalmente, reranking con un cross-encoder en CPU.
+from __future__ import annotations
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Optional
+
+from langchain_community.vectorstores import FAISS
+
+# artículos, normas y siglas ("27001", "5.2.1", "ISO/IEC") quedan como un solo
+# término además de sus partes
+_TOKEN = re.compile(r"\w+(?:[./\-]\w+)*")
+_STOPWORDS = frozenset("""
+a al algo como con cual de del desde donde e el ella ellos en entre es esta este esto
+fue ha hay la las le les lo los mas me mi no o para pero por que se ser si sin sobre
+su sus te tu un una uno unos y ya
+""".split())
+
+
+def tokenizar(texto: str) -> list[str]:
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    terminos = []
+    for tok in _TOKEN.findall(texto):
+        partes = re.split(r"[./\-]", tok)
+        if len(partes) > 1:
+            terminos.append(tok)
+        terminos.extend(p for p in partes if p and p not in _STOPWORDS)
+    return terminos
+
+
+class IndiceBM25:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # id de chunk -> {término: frecuencia}; las postings se derivan de aquí
+        self.terminos_doc: dict[str, dict[str, int]] = {}
+        self.postings: dict[str, dict[str, int]] = defaultdict(dict)
+        self.largos: dict[str, int] = {}
+        self.largo_total = 0
+
+    def __len__(self) -> int:
+        return len(self.terminos_doc)
+
+    def agregar(self, pares: Iterable[tuple[str, str]]) -> None:
+        for doc_id, texto in pares:
+            if doc_id in self.terminos_doc:
+                continue
+            tf: dict[str, int] = defaultdict(int)
+            for t in tokenizar(texto):
+                tf[t] += 1
+            self._indexar(doc_id, dict(tf))
+
+    def _indexar(self, doc_id: str, tf: dict[str, int]) -> None:
+        self.terminos_doc[doc_id] = tf
+        largo = sum(tf.values())
+        self.largos[doc_id] = largo
+        self.largo_total += largo
+        for t, f in tf.items():
+            self.postings[t][doc_id] = f
+
+    def quitar(self, ids: Iterable[str]) -> None:
+        for doc_id in ids:
+            tf = self.terminos_doc.pop(doc_id, None)
+            if tf is None:
+                continue
+            self.largo_total -= self.largos.pop(doc_id, 0)
+            for t in tf:
+                post = self.postings.get(t)
+                if post is not None:
+                    post.pop(doc_id, None)
+                    if not post:
+                        del self.postings[t]
+
+    def buscar(self, consulta: str, n: int) -> list[tuple[str, float]]:
+        total = len(self.terminos_doc)
+        if not total:
+            return []
+        promedio = self.largo_total / total or 1.0
+        puntajes: dict[str, float] = defaultdict(float)
+        for t in set(tokenizar(consulta)):
+            post = self.postings.get(t)
+            if not post:
+                continue
+            idf = math.log(1 + (total - len(post) + 0.5) / (len(post) + 0.5))
+            for doc_id, f in post.items():
+                norm = self.k1 * (1 - self.b + self.b * self.largos[doc_id] / promedio)
+                puntajes[doc_id] += idf * f * (self.k1 + 1) / (f + norm)
+        return heapq.nlargest(n, puntajes.items(), key=lambda x: x[1])
+
+    def sincronizar(self, vs: Optional[FAISS]) -> tuple[int, int]:
+        """Deja en el índice exactamente los chunks del docstore de `vs`."""
+        ids_vs = set(vs.index_to_docstore_id.values()) if vs is not None else set()
+        sobran = [i for i in self.terminos_doc if i not in ids_vs]
+        faltan = [i for i in ids_vs if i not in self.terminos_doc]
+        self.quitar(sobran)
+        self.agregar((i, vs.docstore.search(i).page_content) for i in faltan)
+        return len(faltan), len(sobran)
+
+    def guardar(self, ruta: Path) -> None:
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        tmp = ruta.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"k1": self.k1, "b": self.b, "docs": self.terminos_doc}), encoding="utf-8")
+        os.replace(tmp, ruta)
+
+    @classmethod
+    def cargar(cls, ruta: Path) -> "IndiceBM25":
+        indice = cls()
+        try:
+            datos = json.loads(ruta.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return indice
+        except Exception as e:
+            print(f"[BM25] No se pudo leer {ruta}, se reconstruirá: {e}")
+            return indice
+        indice.k1, indice.b = datos.get("k1", indice.k1), datos.get("b", indice.b)
+        for doc_id, tf in datos.get("docs", {}).items():
+            indice._indexar(doc_id, tf)
+        return indice
+
+
+def fusion_rrf(rankings: list[list[str]], k: int = 60) -> list[str]:
+    """Reciprocal Rank Fusion: cada lista aporta 1/(k + rango) a cada ID."""
+    puntajes: dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rango, doc_id in enumerate(ranking, start=1):
+            puntajes[doc_id] += 1.0 / (k + rango)
+    return sorted(puntajes, key=puntajes.get, reverse=True)
+
+
+class Reranker:
+    """Cross-encoder de sentence-transformers, se carga en el primer uso."""
+
+    def __init__(self, modelo: str):
+        self.modelo = modelo
+        self._encoder = None
+        self._lock = threading.Lock()
+
+    def _cargar(self):
+        if self._encoder is None:
+            with self._lock:
+                if self._encoder is None:
+                    from sentence_transformers import CrossEncoder
+                    self._encoder = CrossEncoder(self.modelo, device="cpu")
+        return self._encoder
+
+    def ordenar(self, pregunta: str, textos: list[str]) -> list[int]:
+        if not textos:
+            return []
+        puntajes = self._cargar().predict([(pregunta, t) for t in textos])
+        return sorted(range(len(textos)), key=lambda i: float(puntajes[i]), reverse=True)
@@ -1,30 +1,85 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from database import get_db
+from database import get_async_db
 from models.user import User
 from schemas.user import UserCreate, UserResetPassword, UserUpdate, UserOut, Token  # 👈 Aquí está el fix
 from config import settings
+from concurrencia import Saturado
+from contrasenas import IntentosLogin, PoolContrasenas, hashear_sync, verificar_sync
+import metricas
+from metricas import medir
 
 SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = settings.ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
+AUTH_CACHE_TTL = settings.AUTH_CACHE_TTL
 
 router = APIRouter()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
+# bcrypt es CPU a propósito: los endpoints lo mandan al pool de procesos
+pool_contrasenas = PoolContrasenas(
+    settings.AUTH_HASH_WORKERS,
+    settings.AUTH_BCRYPT_ROUNDS,
+    max_cola=settings.AUTH_HASH_MAX_COLA,
+    espera_max=settings.AUTH_HASH_ESPERA_MAX,
+)
+intentos_login = IntentosLogin(
+    settings.AUTH_LOGIN_MAX_FALLOS_IP, settings.AUTH_LOGIN_MAX_FALLOS_CUENTA, settings.AUTH_LOGIN_VENTANA
+)
+
+metricas.Medidor("rag_auth_contrasenas", "Operaciones bcrypt del pool de contraseñas.",
+                 lambda: {k: v for k, v in pool_contrasenas.estadisticas().items() if k not in ("workers", "costo")},
+                 etiquetas=("tipo",))
+metricas.Medidor("rag_auth_login_bloqueos_total", "Logins rechazados por exceso de fallos.",
+                 lambda: intentos_login.estadisticas()["bloqueos"],
+                 etiquetas=("motivo",), tipo="counter")
+
+# versiones sync para scripts (benchmark, carga inicial)
 def get_password_hash(password: str):
-    return pwd_context.hash(password)
+    return hashear_sync(password, settings.AUTH_BCRYPT_ROUNDS)
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return verificar_sync(plain_password, hashed_password, settings.AUTH_BCRYPT_ROUNDS)[0]
+
+async def _contrasena(operacion):
+    try:
+        with medir("auth_bcrypt"):
+            return await operacion
+    except Saturado as e:
+        raise HTTPException(
+            status_code=503,
+            detail={"mensaje": f"Demasiados logins simultáneos: {e}", "reintentar_en": e.reintentar},
+            headers={"Retry-After": str(e.reintentar)},
+        )
+
+async def hashear_password(password: str) -> str:
+    return await _contrasena(pool_contrasenas.hashear(password))
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(User).filter(User.email == email).first()
+async def verificar_password(password: str, hashed: Optional[str]) -> tuple[bool, Optional[str]]:
+    return await _contrasena(pool_contrasenas.verificar(password, hashed))
+
+def _ip_cliente(request: Request) -> str:
+    if settings.AUTH_IP_DESDE_PROXY:
+        reenviada = request.headers.get("x-forwarded-for", "").split(",")[0].strip()
+        if reenviada:
+            return reenviada
+    return request.client.host if request.client else "desconocida"
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    return (await db.execute(select(User).where(User.email == email))).scalars().first()
+
+async def get_user_by_rut(db: AsyncSession, rut: str):
+    return (await db.execute(select(User).where(User.rut == rut))).scalars().first()
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -32,26 +87,81 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
-    credentials_exception = HTTPException(
+def token_de_usuario(user: User) -> str:
+    # con role y rut en los claims get_current_claims no consulta la BD
+    return create_access_token(data={"sub": user.email, "role": user.role, "rut": user.rut})
+
+# --- usuario autenticado ---
+# get_current_user entrega un Principal (copia de los datos del usuario, sin sesión
+# de BD) y lo guarda AUTH_CACHE_TTL segundos por `sub`. Cada worker tiene su propio
+# cache: cambios hechos en otro worker se ven, como mucho, al vencer el TTL.
+@dataclass(frozen=True)
+class Principal:
+    rut: str
+    email: str
+    role: str
+    nombre: str = ""
+    apellido: str = ""
+
+    @classmethod
+    def de_usuario(cls, user: User) -> "Principal":
+        return cls(rut=user.rut, email=user.email, role=user.role, nombre=user.nombre, apellido=user.apellido)
+
+_principales: dict[str, tuple[float, Principal]] = {}
+_principales_lock = threading.Lock()
+
+def invalidar_principal(*emails: Optional[str]) -> None:
+    with _principales_lock:
+        for email in emails:
+            _principales.pop(email, None)
+
+def _credenciales_invalidas() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudo validar las credenciales.",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if not email:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-
-    user = get_user_by_email(db, email=email)
+
+def _decodificar(token: str) -> dict:
+    with medir("auth_jwt"):
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            raise _credenciales_invalidas()
+    if not payload.get("sub"):
+        raise _credenciales_invalidas()
+    return payload
+
+async def _principal(db: AsyncSession, email: str) -> Principal:
+    ahora = time.monotonic()
+    with _principales_lock:
+        guardado = _principales.get(email)
+    if guardado is not None and ahora - guardado[0] < AUTH_CACHE_TTL:
+        return guardado[1]
+    with medir("auth_usuario"):
+        user = await get_user_by_email(db, email=email)
     if not user:
-        raise credentials_exception
-    return user
+        invalidar_principal(email)
+        raise _credenciales_invalidas()
+    principal = Principal.de_usuario(user)
+    if AUTH_CACHE_TTL > 0:
+        with _principales_lock:
+            _principales[email] = (ahora, principal)
+    return principal
 
-def verificar_admin(user: User = Depends(get_current_user)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> Principal:
+    return await _principal(db, _decodificar(token)["sub"])
+
+async def get_current_claims(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> Principal:
+    """Para endpoints que solo necesitan `rut` y `role`: los toma del token, sin BD.
+    Un usuario eliminado o con otro rol sigue valiendo hasta que expire su token.
+    Tokens emitidos antes de incluir `rut` caen a get_current_user."""
+    payload = _decodificar(token)
+    if payload.get("rut") and payload.get("role"):
+        return Principal(rut=payload["rut"], email=payload["sub"], role=payload["role"])
+    return await _principal(db, payload["sub"])
+
+async def verificar_admin(user: Principal = Depends(get_current_user)):
     if user.role != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -60,8 +170,8 @@ def verificar_admin(user: User = Depends(get_current_user)):
     return user
 
 @router.post("/registro_admin")
-def registrar_admin(user: UserCreate, db: Session = Depends(get_db)):
-    hashed_password = get_password_hash(user.password)
+async def registrar_admin(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    hashed_password = await hashear_password(user.password)
     nuevo_usuario = User(
         rut=user.rut,
         nombre=user.nombre,
@@ -71,26 +181,48 @@ def registrar_admin(user: UserCreate, db: Session = Depends(get_db)):
         role=user.role
     )
     db.add(nuevo_usuario)
-    db.commit()
-    db.refresh(nuevo_usuario)
+    await db.commit()
     return {"mensaje": "✅ Administrador creado exitosamente"}
 
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = get_user_by_email(db, form_data.username)
-    if not user or not verify_password(form_data.password, user.password):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    # el freno va antes de bcrypt: un ataque de fuerza bruta no gasta CPU
+    ip, cuenta = _ip_cliente(request), form_data.username.strip().lower()
+    espera, motivo = intentos_login.espera(ip, cuenta)
+    if espera:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Demasiados intentos fallidos ({motivo}). Reintenta en {espera} s.",
+            headers={"Retry-After": str(espera)},
+        )
+
+    user = await get_user_by_email(db, form_data.username)
+    # sin usuario también se compara (contra un hash ficticio): misma demora
+    ok, nuevo_hash = await verificar_password(form_data.password, user.password if user else None)
+    if not user or not ok:
+        intentos_login.fallo(ip, cuenta)
         raise HTTPException(status_code=401, detail="Credenciales inválidas.")
+    intentos_login.exito(cuenta)
+
+    if nuevo_hash:
+        # cambió AUTH_BCRYPT_ROUNDS: se guarda el hash con el costo nuevo
+        try:
+            user.password = nuevo_hash
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            print("[auth] No se pudo actualizar el hash:", repr(e))
 
-    access_token = create_access_token(data={"sub": user.email, "role": user.role})
+    access_token = token_de_usuario(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/registro_usuario")
-def registrar_usuario(user: UserCreate, db: Session = Depends(get_db)):
-    existente = get_user_by_email(db, user.email)
+async def registrar_usuario(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    existente = await get_user_by_email(db, user.email)
     if existente:
         raise HTTPException(status_code=400, detail="El correo ya está registrado.")
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hashear_password(user.password)
     nuevo_usuario = User(
         rut=user.rut,
         nombre=user.nombre,
@@ -100,62 +232,65 @@ def registrar_usuario(user: UserCreate, db: Session = Depends(get_db)):
         role=user.role
     )
     db.add(nuevo_usuario)
-    db.commit()
-    db.refresh(nuevo_usuario)
+    await db.commit()
     return {"mensaje": "✅ Usuario registrado exitosamente"}
 
 @router.get("/usuarios", response_model=list[UserOut])
-def obtener_usuarios(db: Session = Depends(get_db), user: User = Depends(verificar_admin)):
-    return db.query(User).all()
+async def obtener_usuarios(db: AsyncSession = Depends(get_async_db), user: Principal = Depends(verificar_admin)):
+    return (await db.execute(select(User))).scalars().all()
 
 @router.put("/usuarios/{rut}")
-def actualizar_usuario(
+async def actualizar_usuario(
     rut: str,
     user_update: UserUpdate,
-    db: Session = Depends(get_db),
-    user: User = Depends(verificar_admin)
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(verificar_admin)
 ):
-    usuario = db.query(User).filter(User.rut == rut).first()
+    usuario = await get_user_by_rut(db, rut)
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
+    email_anterior = usuario.email
     usuario.nombre = user_update.nombre
     usuario.apellido = user_update.apellido
     usuario.email = user_update.email
     usuario.role = user_update.role
 
-    db.commit()
+    await db.commit()
+    invalidar_principal(email_anterior, user_update.email)
     return {"mensaje": f"✅ Usuario {rut} actualizado correctamente"}
 
 @router.delete("/usuarios/{rut}")
-def eliminar_usuario(rut: str, db: Session = Depends(get_db), user: User = Depends(verificar_admin)):
-    usuario = db.query(User).filter(User.rut == rut).first()
+async def eliminar_usuario(rut: str, db: AsyncSession = Depends(get_async_db), user: Principal = Depends(verificar_admin)):
+    usuario = await get_user_by_rut(db, rut)
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    db.delete(usuario)
-    db.commit()
+    email = usuario.email
+    await db.delete(usuario)
+    await db.commit()
+    invalidar_principal(email)
     return {"mensaje": f"🗑️ Usuario {rut} eliminado correctamente"}
 
 @router.put("/usuarios/reset_password/{rut}")
-def reset_password(
+async def reset_password(
     rut: str, 
     datos: UserResetPassword,
-    db: Session = Depends(get_db),
-    user: User = Depends(verificar_admin) 
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(verificar_admin) 
 ):
-    print('LLEGA BIEN')
-    try:
-        usuario = db.query(User).filter(User.rut == rut).first()
-        if not usuario:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    except Exception as e:
-        raise f'Error obtener usuario: {e}'
+    usuario = await get_user_by_rut(db, rut)
+    if not usuario:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
+    # un 503 del pool de contraseñas (saturado) sale tal cual
+    usuario.password = await hashear_password(datos.nueva_password)
     try:
-        usuario.password = get_password_hash(datos.nueva_password)
-        db.commit()
-    except Exception as ex:
-        raise f'Error generar hash: {e}'
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        print("[reset_password] ERROR:", repr(e))
+        raise HTTPException(status_code=500, detail=f"Error al guardar la contraseña: {type(e).__name__}: {e}")
+    invalidar_principal(usuario.email)
+    intentos_login.exito(usuario.email.lower())
 
-    
     return {"mensaje": f"🔑 Contraseña de {rut} actualizada correctamente"}
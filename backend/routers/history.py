@@ -1,21 +1,78 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import get_db
+import base64
+import os
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from buffer_historial import BufferHistorial
+from database import SessionLocal, get_async_db
 from models.history import History
-from models.user import User
 from schemas.history import HistoryCreate, HistoryOut
-from routers.auth import get_current_user
+from routers.auth import Principal, get_current_claims
 
 router = APIRouter()
 
+# /preguntar no escribe el historial en el request: lo encola aquí
+buffer_historial = BufferHistorial(
+    SessionLocal,
+    max_lote=int(os.getenv("RAG_HISTORIAL_LOTE", "100")),
+    intervalo=float(os.getenv("RAG_HISTORIAL_INTERVALO", "0.5")),
+    max_pendientes=int(os.getenv("RAG_HISTORIAL_MAX_PENDIENTES", "10000")),
+)
+
+# cursor opaco: timestamp e id de la última fila entregada
+def _cursor(h: History) -> str:
+    return base64.urlsafe_b64encode(f"{h.timestamp.isoformat()}|{h.id}".encode()).decode()
+
+def _leer_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        ts, id_ = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(ts), int(id_)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def _filtro_texto(db: AsyncSession, q: str):
+    if db.bind.dialect.name == "postgresql":
+        # usa el índice GIN ix_histories_pregunta_fts
+        return func.to_tsvector("spanish", History.pregunta).op("@@")(func.plainto_tsquery("spanish", q))
+    # % y _ de la búsqueda son texto, no comodines de LIKE
+    literal = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return History.pregunta.ilike(f"%{literal}%", escape="\\")
+
 @router.post("/historial", response_model=HistoryOut)
-def guardar_historial(data: HistoryCreate, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+async def guardar_historial(data: HistoryCreate, db: AsyncSession = Depends(get_async_db), user: Principal = Depends(get_current_claims)):
     historial = History(pregunta=data.pregunta, respuesta=data.respuesta, user_rut=user.rut)
     db.add(historial)
-    db.commit()
-    db.refresh(historial)
+    await db.commit()
+    await db.refresh(historial)
     return historial
 
 @router.get("/historial", response_model=list[HistoryOut])
-def obtener_historial(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    return db.query(History).filter(History.user_rut == user.rut).order_by(History.timestamp.desc()).all()
+async def obtener_historial(
+    response: Response,
+    limite: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    q: Optional[str] = Query(None, min_length=2, description="buscar en preguntas anteriores"),
+    db: AsyncSession = Depends(get_async_db),
+    user: Principal = Depends(get_current_claims),
+):
+    # paginación por cursor sobre (timestamp, id) descendente; la página siguiente
+    # se pide con el valor de la cabecera X-Siguiente-Cursor
+    # solo las filas de este usuario que siguen sin escribir (encoladas o en curso)
+    if buffer_historial.pendientes(user.rut):
+        await run_in_threadpool(buffer_historial.vaciar, user.rut)
+    consulta = select(History).where(History.user_rut == user.rut)
+    if q:
+        consulta = consulta.where(_filtro_texto(db, q))
+    if cursor:
+        ts, id_ = _leer_cursor(cursor)
+        consulta = consulta.where(or_(History.timestamp < ts, and_(History.timestamp == ts, History.id < id_)))
+    consulta = consulta.order_by(History.timestamp.desc(), History.id.desc()).limit(limite + 1)
+    filas = (await db.execute(consulta)).scalars().all()
+    if len(filas) > limite:
+        filas = filas[:limite]
+        response.headers["X-Siguiente-Cursor"] = _cursor(filas[-1])
+    return filas
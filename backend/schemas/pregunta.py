@@ -1,7 +1,10 @@
+from typing import Optional
 from pydantic import BaseModel
 
 class PreguntaRequest(BaseModel):
     pregunta: str
+    # sin colecciones se consulta en todas las que tienen índice
+    colecciones: Optional[list[str]] = None
 
 class RespuestaResponse(BaseModel):
     respuesta: str
@@ -0,0 +1,6 @@
+# backend/tests/conftest.py
+# Las pruebas importan los módulos del backend como lo hace main.py (sin paquete).
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
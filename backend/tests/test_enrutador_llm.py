@@ -0,0 +1,229 @@
+# backend/tests/test_enrutador_llm.py
+# EnrutadorLLM contra servidores Ollama falsos en el mismo proceso (http.server):
+# ChatOllama real, sin modelos ni red.
+import asyncio
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_ollama import ChatOllama
+
+from enrutador_llm import EnrutadorLLM
+
+prompt = ChatPromptTemplate.from_messages([("human", "{input}")])
+
+
+class OllamaFalso:
+    """GET /api/tags, POST /api/generate (precarga) y POST /api/chat (stream NDJSON).
+    Anota cada POST en `pedidos`; con `falla` el chat responde 500 tras `demora` s,
+    con `caido` /api/tags responde 503 y un modelo que no tiene da 404 como Ollama."""
+
+    def __init__(self, nombre: str, modelos=("grande", "chico")):
+        self.nombre = nombre
+        self.modelos = list(modelos)
+        self.falla = False
+        self.demora = 0.0
+        self.caido = False
+        self.pedidos: list[tuple[str, dict]] = []
+        falso = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, cuerpo: dict, codigo: int = 200) -> None:
+                datos = json.dumps(cuerpo).encode()
+                self.send_response(codigo)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def do_GET(self):
+                if falso.caido:
+                    return self._json({"error": "caído"}, 503)
+                self._json({"models": [{"name": m} for m in falso.modelos]})
+
+            def do_POST(self):
+                cuerpo = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"{}")
+                falso.pedidos.append((self.path, cuerpo))
+                if self.path == "/api/generate":
+                    return self._json({"model": cuerpo["model"], "response": "", "done": True})
+                if falso.falla:
+                    time.sleep(falso.demora)
+                    return self._json({"error": "falla simulada"}, 500)
+                if cuerpo["model"] not in falso.modelos:
+                    return self._json({"error": f"model '{cuerpo['model']}' not found"}, 404)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                base = {"model": cuerpo["model"], "created_at": "2024-01-01T00:00:00Z"}
+                for texto, fin in ((f"desde {falso.nombre}", False), ("", True)):
+                    linea = {**base, "message": {"role": "assistant", "content": texto}, "done": fin}
+                    if fin:
+                        linea["done_reason"] = "stop"
+                    self.wfile.write((json.dumps(linea) + "\n").encode())
+
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", 0), Manejador)
+        self.url = f"http://127.0.0.1:{self.servidor.server_port}"
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+
+    def chats(self) -> int:
+        return sum(1 for ruta, _ in self.pedidos if ruta == "/api/chat")
+
+    def modelos_pedidos(self, ruta: str) -> list[str]:
+        return [c["model"] for r, c in self.pedidos if r == ruta]
+
+    def cerrar(self) -> None:
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+@pytest.fixture
+def servidores():
+    creados: list[OllamaFalso] = []
+
+    def crear(nombre: str, **kw) -> OllamaFalso:
+        creados.append(OllamaFalso(nombre, **kw))
+        return creados[-1]
+
+    yield crear
+    for s in creados:
+        s.cerrar()
+
+
+def url_sin_servidor() -> str:
+    # puerto libre: la conexión se rechaza
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+def enrutador(urls: list[str], **kw) -> EnrutadorLLM:
+    kw.setdefault("intervalo_salud", 0)  # sin hilo: cada prueba chequea cuando quiere
+    return EnrutadorLLM(
+        urls,
+        "grande",
+        fabrica_llm=lambda url, modelo: ChatOllama(model=modelo, base_url=url, temperature=0),
+        fabrica_cadena=lambda llm: prompt | llm | StrOutputParser(),
+        **kw,
+    )
+
+
+def invocar(e: EnrutadorLLM, n: int) -> list[str]:
+    async def todas():
+        return [await e.invocar({"input": f"pregunta {i}"}) for i in range(n)]
+    return asyncio.run(todas())
+
+
+def test_salta_backend_caido(servidores):
+    a = servidores("A")
+    e = enrutador([a.url, url_sin_servidor()], timeout_salud=1)
+    with httpx.Client() as cliente:
+        for b in e.backends:
+            e.chequear(b, cliente)
+
+    assert [b.sano for b in e.backends] == [True, False]
+    assert invocar(e, 4) == ["desde A"] * 4
+    assert a.chats() == 4
+    assert e.backends[1].completadas == e.backends[1].fallos == 0
+
+
+def test_reintenta_y_expulsa_tras_fallos_seguidos(servidores):
+    a, c = servidores("A"), servidores("C")
+    c.falla = True
+    e = enrutador([a.url, c.url], fallos_expulsion=3, segundos_expulsion=60)
+    # C gana los empates (menor latencia): se elige primero hasta que lo expulsan
+    e.backends[0].latencia_salud, e.backends[1].latencia_salud = 1.0, 0.0
+
+    # cada falla de C se reintenta en A: el usuario no ve errores
+    assert invocar(e, 5) == ["desde A"] * 5
+    a_be, c_be = e.backends
+    assert c.chats() == 3 and c_be.fallos == 3
+    assert c_be.expulsado_hasta > time.monotonic() + 50
+    assert not c_be.disponible(time.monotonic())
+    assert a.chats() == 5 and a_be.completadas == 5
+
+
+def test_fallos_concurrentes_expulsan_una_vez(servidores):
+    c = servidores("C")
+    c.falla, c.demora = True, 0.3
+    e = enrutador([c.url], fallos_expulsion=3, segundos_expulsion=60)
+
+    async def a_la_vez():
+        return await asyncio.gather(*(e.invocar({"input": str(i)}) for i in range(6)), return_exceptions=True)
+
+    # las 6 están en curso cuando falla la tercera: las otras 3 no vuelven a expulsar
+    assert all(isinstance(r, Exception) for r in asyncio.run(a_la_vez()))
+    (c_be,) = e.backends
+    assert c.chats() == 6 and c_be.fallos == 6
+    assert c_be.expulsiones == 1 and c_be.fallos_seguidos == 0
+
+
+def test_sin_reintento_con_un_solo_backend(servidores):
+    c = servidores("C")
+    c.falla = True
+    e = enrutador([c.url])
+    with pytest.raises(Exception):
+        invocar(e, 1)
+    assert c.chats() == 1
+
+
+def test_precarga_con_keep_alive(servidores):
+    a = servidores("A")
+    b = servidores("B", modelos=("grande",))  # sin el modelo de respaldo
+    e = enrutador([a.url, b.url], modelo_respaldo="chico", keep_alive="15m", intervalo_salud=60)
+    e.iniciar()
+    try:
+        limite = time.monotonic() + 10
+        while len(a.pedidos) + len(b.pedidos) < 3 and time.monotonic() < limite:
+            time.sleep(0.05)
+    finally:
+        e.cerrar()
+
+    precargas = lambda s: sorted((c["model"], c["keep_alive"]) for ruta, c in s.pedidos if ruta == "/api/generate")
+    assert precargas(a) == [("chico", "15m"), ("grande", "15m")]
+    assert precargas(b) == [("grande", "15m")]
+    assert e.backends[1].modelos == {"grande"}
+
+
+def test_respaldo_que_no_tiene_ningun_backend(servidores):
+    a, b = servidores("A", modelos=("grande",)), servidores("B", modelos=("grande",))
+    # cola siempre larga: se pediría el respaldo
+    e = enrutador([a.url, b.url], modelo_respaldo="chico", cola=lambda: 100, fallos_expulsion=2)
+    pedidos = lambda: a.modelos_pedidos("/api/chat") + b.modelos_pedidos("/api/chat")
+
+    # sin chequeo no se sabe qué modelos tienen: el 404 del respaldo se reintenta con
+    # el principal y no cuenta como falla ni expulsa al backend
+    assert set(invocar(e, 4)) <= {"desde A", "desde B"}
+    assert all(be.fallos == be.expulsiones == 0 for be in e.backends)
+    assert all(be.disponible(time.monotonic()) for be in e.backends)
+
+    # con los modelos conocidos ya no se pide el respaldo
+    with httpx.Client() as cliente:
+        for be in e.backends:
+            e.chequear(be, cliente)
+    antes = len(pedidos())
+    respaldos = e.respaldos
+    assert set(invocar(e, 4)) <= {"desde A", "desde B"}
+    assert pedidos()[antes:] == ["grande"] * 4
+    assert e.respaldos == respaldos
+
+
+def test_precarga_al_volver_a_servicio(servidores):
+    a = servidores("A")
+    a.caido = True
+    e = enrutador([a.url], keep_alive="15m")
+    with httpx.Client() as cliente:
+        e.chequear(e.backends[0], cliente)
+        assert not e.backends[0].sano and a.modelos_pedidos("/api/generate") == []
+        a.caido = False
+        e.chequear(e.backends[0], cliente)
+    assert e.backends[0].sano
+    assert a.modelos_pedidos("/api/generate") == ["grande"]
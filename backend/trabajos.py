@@ -0,0 +1,111 @@
+# backend/trabajos.py
+# Cola de trabajos en segundo plano para la ingesta (/cargar_documento, /reindex, ...):
+# el endpoint responde con un ID y el avance se consulta en /trabajos/{id}.
+from __future__ import annotations
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+ERROR = "error"
+
+
+class ColaLlena(Exception):
+    pass
+
+
+@dataclass
+class Trabajo:
+    id: str
+    tipo: str
+    estado: str = PENDIENTE
+    progreso: float = 0.0
+    mensaje: str = ""
+    resultado: Any = None
+    error: Optional[str] = None
+    creado: float = field(default_factory=time.time)
+    iniciado: Optional[float] = None
+    terminado: Optional[float] = None
+
+    def avance(self, progreso: float, mensaje: str = "") -> None:
+        self.progreso = max(0.0, min(1.0, progreso))
+        if mensaje:
+            self.mensaje = mensaje
+
+    def como_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "tipo": self.tipo,
+            "estado": self.estado,
+            "progreso": round(self.progreso, 3),
+            "mensaje": self.mensaje,
+            "resultado": self.resultado,
+            "error": self.error,
+            "creado": self.creado,
+            "iniciado": self.iniciado,
+            "terminado": self.terminado,
+        }
+
+
+class GestorTrabajos:
+    def __init__(self, max_workers: int = 2, max_pendientes: int = 32, max_historial: int = 200):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingesta")
+        self._trabajos: OrderedDict[str, Trabajo] = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_pendientes = max_pendientes
+        self.max_historial = max_historial
+
+    def pendientes(self) -> int:
+        with self._lock:
+            return sum(1 for t in self._trabajos.values() if t.estado in (PENDIENTE, EN_CURSO))
+
+    def enviar(self, tipo: str, fn: Callable[..., Any], *args, **kwargs) -> Trabajo:
+        """Encola `fn(trabajo, *args, **kwargs)`; lo que devuelva queda en `resultado`."""
+        trabajo = Trabajo(id=uuid.uuid4().hex, tipo=tipo)
+        with self._lock:
+            activos = sum(1 for t in self._trabajos.values() if t.estado in (PENDIENTE, EN_CURSO))
+            if activos >= self.max_pendientes:
+                raise ColaLlena(f"Hay {activos} trabajos de ingesta en cola")
+            self._trabajos[trabajo.id] = trabajo
+            self._podar()
+        self._pool.submit(self._ejecutar, trabajo, fn, args, kwargs)
+        return trabajo
+
+    def _ejecutar(self, trabajo: Trabajo, fn, args, kwargs) -> None:
+        trabajo.estado = EN_CURSO
+        trabajo.iniciado = time.time()
+        try:
+            trabajo.resultado = fn(trabajo, *args, **kwargs)
+            trabajo.progreso = 1.0
+            trabajo.estado = COMPLETADO
+        except Exception as e:
+            print(f"[trabajos] {trabajo.tipo} {trabajo.id} ERROR:", repr(e))
+            traceback.print_exc()
+            trabajo.error = f"{type(e).__name__}: {e}"
+            trabajo.estado = ERROR
+        finally:
+            trabajo.terminado = time.time()
+
+    def _podar(self) -> None:
+        # descarta los terminados más antiguos
+        exceso = len(self._trabajos) - self.max_historial
+        for tid in [t.id for t in self._trabajos.values() if t.estado in (COMPLETADO, ERROR)][:max(exceso, 0)]:
+            del self._trabajos[tid]
+
+    def obtener(self, trabajo_id: str) -> Optional[Trabajo]:
+        with self._lock:
+            return self._trabajos.get(trabajo_id)
+
+    def listar(self) -> list[Trabajo]:
+        with self._lock:
+            return list(reversed(self._trabajos.values()))
+
+    def cerrar(self) -> None:
+        self._pool.shutdown(wait=True, cancel_futures=True)